@@ -0,0 +1,94 @@
+"""Compare the memory and storage size of Seen's packed index with the old per-member layout.
+
+The old layout kept a dict of Python ints per guild in memory and stored every member as a
+``"<member_id>": {"seen": <timestamp>}`` JSON object. The packed layout is :class:`LastSeenIndex`
+in memory and its base64 blob in config. Members get random snowflakes and timestamps spread
+over a year, memory is measured with tracemalloc and storage as the size of the JSON dump.
+
+Usage::
+
+    python benchmarks/index_size.py --members 10000 100000 500000
+
+The index itself has no dependencies, so this runs without Red-DiscordBot installed.
+"""
+import argparse
+import json
+import random
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "seen"))
+
+from index import LastSeenIndex  # noqa: E402
+
+YEAR = 365 * 86400
+
+
+def generate(count: int, seed: int):
+    rng = random.Random(seed)
+    now = int(time.time())
+    # snowflakes of accounts made over the last few years
+    return {rng.randrange(1 << 56, 1 << 60): now - rng.randrange(YEAR) for _ in range(count)}
+
+
+def measure_memory(build) -> int:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    built = build()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del built
+    return size
+
+
+def run(count: int, seed: int) -> dict:
+    data = generate(count, seed)
+    # rebuilt inside the measurement, otherwise the ints would be shared with `data`
+    items = [(str(member_id), str(seen)) for member_id, seen in data.items()]
+    old_memory = measure_memory(lambda: {int(member_id): int(seen) for member_id, seen in items})
+    new_memory = measure_memory(lambda: LastSeenIndex({int(member_id): int(seen) for member_id, seen in items}))
+    old_disk = len(json.dumps({str(member_id): {"seen": seen} for member_id, seen in data.items()}))
+    index = LastSeenIndex(data)
+    new_disk = len(json.dumps(index.pack()))
+
+    cutoff = int(time.time())
+    start = time.perf_counter()
+    inactive = index.inactive_since(cutoff)
+    # a graveyard page holds about 20 members
+    first_page = [next(inactive) for _ in range(min(20, count))]
+    page_ms = (time.perf_counter() - start) * 1000
+    assert len(first_page) == min(20, count)
+
+    return {
+        "members": count,
+        "memory_old_b_per_member": round(old_memory / count),
+        "memory_new_b_per_member": round(new_memory / count),
+        "disk_old_b_per_member": round(old_disk / count),
+        "disk_new_b_per_member": round(new_disk / count),
+        "first_page_ms": round(page_ms, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--members", type=int, nargs="+", default=[10_000, 100_000, 500_000])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    results = [run(count, args.seed) for count in args.members]
+    if args.json:
+        print(json.dumps(results))
+        return
+    print("  members   memory old -> new (B/member)   on disk old -> new (B/member)   first page")
+    for r in results:
+        print(
+            "{members:>9}   {memory_old_b_per_member:>10} -> {memory_new_b_per_member:<14}"
+            "   {disk_old_b_per_member:>11} -> {disk_new_b_per_member:<15}   {first_page_ms} ms".format(**r)
+        )
+
+
+if __name__ == "__main__":
+    main()
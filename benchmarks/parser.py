@@ -0,0 +1,138 @@
+"""Time Counting's message parser against the int() and float() checks it replaced.
+
+The corpus is either synthetic but shaped like counting channel traffic, 85% correct counts,
+7% near misses, 6% chatter and 2% pasted walls of text, or read from a file with one message
+per line, e.g. an export of a real counting channel. Times are nanoseconds per message, the
+best of several runs. ``--check`` also compares the classification of random strings with the
+old checks, which must agree on every string the parser looks at.
+
+Usage::
+
+    python benchmarks/parser.py
+    python benchmarks/parser.py --corpus channel.txt --check 300000
+
+The parser has no dependencies, so this runs without Red-DiscordBot installed.
+"""
+import argparse
+import importlib.util
+import json
+import random
+import string
+import time
+from pathlib import Path
+
+# loaded from its file, the counting package itself needs Red
+_spec = importlib.util.spec_from_file_location(
+    "counting_parser", Path(__file__).resolve().parent.parent / "counting" / "parser.py"
+)
+parser = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(parser)
+
+CHATTER = ["lol", "nice", "oops", "who broke it", "gg", "again??", "100 soon", "brb", "1 2 3", "this channel lol"]
+
+
+def old_classify(content: str):
+    """What on_message did before the parser: int() with a float() fallback."""
+    try:
+        return parser.INTEGER, int(content)
+    except ValueError:
+        pass
+    try:
+        float(content)
+    except ValueError:
+        return parser.TEXT, None
+    return parser.NUMERIC, None
+
+
+def generate(count: int, seed: int):
+    """Return ``{category: [message, ...]}`` of a synthetic counting channel."""
+    rng = random.Random(seed)
+    corpus = {"integers": [], "short text": [], "long text": []}
+    number = rng.randrange(1000, 50000)
+    for _ in range(count):
+        roll = rng.random()
+        if roll < 0.85:
+            number += 1
+            corpus["integers"].append(str(number))
+        elif roll < 0.92:
+            corpus["integers"].append(str(number + rng.choice([-1, 0, 2, 10])))
+        elif roll < 0.98:
+            corpus["short text"].append(rng.choice(CHATTER))
+        else:
+            corpus["long text"].append(" ".join(rng.choice(CHATTER) for _ in range(rng.randrange(20, 200))))
+    return corpus
+
+
+def load_corpus(path: Path):
+    corpus = {"integers": [], "short text": [], "long text": []}
+    with path.open(encoding="utf-8") as f:
+        for line in f:
+            content = line.rstrip("\n")
+            if len(content) > parser.MAX_LENGTH:
+                corpus["long text"].append(content)
+            elif old_classify(content)[0] == parser.INTEGER:
+                corpus["integers"].append(content)
+            else:
+                corpus["short text"].append(content)
+    return corpus
+
+
+def time_per_message(classify, messages, repeat: int) -> float:
+    if not messages:
+        return 0.0
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        for content in messages:
+            classify(content)
+        best = min(best, time.perf_counter_ns() - start)
+    return best / len(messages)
+
+
+def check(count: int, seed: int) -> int:
+    """Return how many random strings the parser classifies differently than the old checks."""
+    rng = random.Random(seed)
+    alphabet = string.digits * 4 + "+-_. eE\t" + "infatyINF" + "xob" + "٣"
+    mismatches = 0
+    for _ in range(count):
+        content = "".join(rng.choice(alphabet) for _ in range(rng.randrange(0, parser.MAX_LENGTH + 1)))
+        if parser.classify(content) != old_classify(content):
+            mismatches += 1
+    return mismatches
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arguments.add_argument("--corpus", help="file with one message per line instead of the synthetic corpus")
+    arguments.add_argument("--messages", type=int, default=10_000, help="size of the synthetic corpus")
+    arguments.add_argument("--repeat", type=int, default=20, help="runs per measurement, the best one counts")
+    arguments.add_argument("--check", type=int, default=0, help="number of random strings to compare with the old checks")
+    arguments.add_argument("--seed", type=int, default=0)
+    arguments.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = arguments.parse_args()
+
+    corpus = load_corpus(Path(args.corpus)) if args.corpus else generate(args.messages, args.seed)
+    corpus = {"all": [content for messages in corpus.values() for content in messages], **corpus}
+    classifiers = {
+        "old": old_classify,
+        "new": parser.classify,
+        "new+expressions": lambda content: parser.classify(content, True),
+    }
+    results = {
+        category: {name: round(time_per_message(classify, messages, args.repeat)) for name, classify in classifiers.items()}
+        for category, messages in corpus.items()
+    }
+    if args.check:
+        results["check_mismatches"] = check(args.check, args.seed)
+    if args.json:
+        print(json.dumps(results))
+        return
+    print("ns per message    " + "".join(f"{name:>17}" for name in classifiers))
+    for category, messages in corpus.items():
+        print(f"{category:<11}{len(messages):>6}" + "".join(f"{results[category][name]:>17}" for name in classifiers))
+    if args.check:
+        print(f"{results['check_mismatches']} of {args.check} random strings classified differently than before")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""Replay gateway events through Seen and Counting without a Discord connection.
+
+The cogs run against a stand-in bot and Red's JSON config backend in a temporary data
+directory, with events built from plain objects that have the attributes the listeners use.
+Events are either generated or read from a JSON lines recording, one event per line::
+
+    {"type": "message", "guild": 1, "channel": 10, "author": 100, "content": "42"}
+    {"type": "typing" | "edit" | "reaction" | "voice", "guild": 1, "channel": 10, "author": 100}
+
+Usage::
+
+    python benchmarks/replay.py --events 100000 --guilds 50 --members 2000
+    python benchmarks/replay.py --recording events.jsonl --rate 2000 --json
+
+This needs Red-DiscordBot installed, like the cogs themselves.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+EVENT_TYPES = ("message", "edit", "typing", "reaction", "voice")
+
+
+class FakeBot:
+    """The parts of Red the cogs use, for a bot that is always ready and never connected."""
+
+    def __init__(self, guilds):
+        self.loop = asyncio.get_running_loop()
+        self.guilds = guilds
+
+    async def wait_until_ready(self):
+        pass
+
+    async def wait_until_red_ready(self):
+        pass
+
+    def get_user(self, user_id):
+        return None
+
+
+async def _noop(*args, **kwargs):
+    pass
+
+
+def make_guild(guild_id: int, counting_channel_id: int):
+    guild = SimpleNamespace(id=guild_id, members={}, roles={})
+    guild.get_member = guild.members.get
+    guild.get_role = guild.roles.get
+    channel = SimpleNamespace(id=counting_channel_id, guild=guild, send=_noop, set_permissions=_noop)
+    guild.get_channel = {channel.id: channel}.get
+    guild.counting_channel = channel
+    return guild
+
+
+def guess_counting_channels(events):
+    """Take the channel with the most numeric messages of each guild in a recording as its counting channel."""
+    numeric = {}
+    for kind, guild_id, channel_id, _member_id, content in events:
+        per_guild = numeric.setdefault(guild_id, {})
+        if kind == "message" and content.strip().isdecimal():
+            per_guild[channel_id] = per_guild.get(channel_id, 0) + 1
+    return {
+        guild_id: max(channels, key=channels.get) if channels else 0
+        for guild_id, channels in numeric.items()
+    }
+
+
+def member(guild, member_id: int):
+    found = guild.members.get(member_id)
+    if found is None:
+        found = guild.members[member_id] = SimpleNamespace(
+            id=member_id, guild=guild, bot=False, display_name=f"member{member_id}", add_roles=_noop
+        )
+    return found
+
+
+_message_ids = itertools.count(1)
+
+
+def message(guild, channel, author, content: str):
+    return SimpleNamespace(
+        id=next(_message_ids), guild=guild, channel=channel, author=author, content=content, add_reaction=_noop
+    )
+
+
+def generate(channels, member_ids, count: int, counting_share: float, seed: int):
+    """Yield ``(type, guild_id, channel_id, member_id, content)`` with mostly correct counts."""
+    rng = random.Random(seed)
+    numbers = dict.fromkeys(channels, 0)
+    guild_ids = list(channels)
+    for _ in range(count):
+        guild_id = rng.choice(guild_ids)
+        member_id = rng.choice(member_ids)
+        channel_id = channels[guild_id]
+        if rng.random() < counting_share:
+            if rng.random() < 0.9:
+                numbers[guild_id] += 1
+                content = str(numbers[guild_id])
+            else:
+                content = rng.choice(["lol", "oops", str(numbers[guild_id] + rng.randint(2, 5))])
+                numbers[guild_id] = 0
+            yield "message", guild_id, channel_id, member_id, content
+        else:
+            # activity outside the counting channel
+            yield rng.choice(EVENT_TYPES), guild_id, channel_id + 1, member_id, "hello"
+
+
+def load_recording(path: Path):
+    with path.open(encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                event = json.loads(line)
+                yield event["type"], event["guild"], event["channel"], event["author"], event.get("content", "")
+
+
+def dispatch(seen, counting, guilds, event):
+    """Return the listener coroutines the gateway would start for an event."""
+    kind, guild_id, channel_id, member_id, content = event
+    guild = guilds[guild_id]
+    author = member(guild, member_id)
+    channel = guild.counting_channel if channel_id == guild.counting_channel.id else SimpleNamespace(id=channel_id, guild=guild)
+    if kind == "message":
+        msg = message(guild, channel, author, content)
+        return [seen.on_message(msg), counting.on_message(msg)]
+    if kind == "edit":
+        msg = message(guild, channel, author, content)
+        return [seen.on_message_edit(msg, msg)]
+    if kind == "typing":
+        return [seen.on_typing(channel, author, None)]
+    if kind == "reaction":
+        return [seen.on_reaction_add(SimpleNamespace(message=None, emoji="✅"), author)]
+    if kind == "voice":
+        state = SimpleNamespace(channel=None)
+        return [seen.on_voice_state_update(author, state, state)]
+    raise ValueError(f"unknown event type {kind!r}")
+
+
+def percentile(samples, q: float) -> float:
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+async def run(args):
+    from redbot.core import data_manager
+
+    # the same setup Red's own test fixtures use: JSON storage in a throwaway data path
+    data_dir = tempfile.mkdtemp(prefix="red-bench-")
+    data_manager.basic_config = data_manager.basic_config_default.copy()
+    data_manager.basic_config["DATA_PATH"] = data_dir
+    data_manager.basic_config["STORAGE_TYPE"] = "JSON"
+    data_manager.basic_config["STORAGE_DETAILS"] = {}
+
+    from counting.counting import Counting
+    from seen.seen import Seen
+
+    if args.recording:
+        # recordings are read up front, the counting channels have to be known before the cogs load
+        events = list(load_recording(Path(args.recording)))
+        channels = guess_counting_channels(events)
+    else:
+        channels = {guild_id: guild_id * 1000 for guild_id in range(1, args.guilds + 1)}
+        member_ids = list(range(10 ** 6, 10 ** 6 + args.members))
+        events = generate(channels, member_ids, args.events, args.counting_share, args.seed)
+    guilds = {guild_id: make_guild(guild_id, channel_id) for guild_id, channel_id in channels.items()}
+    bot = FakeBot(list(guilds.values()))
+    seen = Seen(bot)
+    await seen.initialize()
+    seen._resolution = args.resolution
+    counting = Counting(bot)
+    for guild in guilds.values():
+        async with counting.config.guild_from_id(guild.id).channels() as guild_channels:
+            guild_channels[str(guild.counting_channel.id)] = {"enabled": True}
+    await counting.cog_load()
+    await seen._migrated.wait()
+
+    n = 0
+    latencies = []
+    flushes = []
+    interval = 1 / args.rate if args.rate else 0
+    start = time.perf_counter()
+    for n, event in enumerate(events, 1):
+        if interval:
+            delay = start + n * interval - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        for coro in dispatch(seen, counting, guilds, event):
+            began = time.perf_counter_ns()
+            await coro
+            latencies.append(time.perf_counter_ns() - began)
+        if n % args.flush_every == 0:
+            began = time.perf_counter()
+            await seen._flush()
+            await counting._save_games()
+            flushes.append(time.perf_counter() - began)
+    elapsed = time.perf_counter() - start
+
+    began = time.perf_counter()
+    await seen.cog_unload()
+    await counting.cog_unload()
+    flushes.append(time.perf_counter() - began)
+
+    return {
+        "events": n,
+        "seconds": round(elapsed, 3),
+        "events_per_sec": round(n / elapsed) if elapsed else 0,
+        "listener_calls": len(latencies),
+        "listener_p50_us": round(percentile(latencies, 0.50) / 1000, 1),
+        "listener_p99_us": round(percentile(latencies, 0.99) / 1000, 1),
+        "flushes": len(flushes),
+        "flush_mean_ms": round(sum(flushes) / len(flushes) * 1000, 2),
+        "flush_max_ms": round(max(flushes) * 1000, 2),
+        # kilobytes on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "data_path": data_dir,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--recording", help="JSON lines file of events to replay instead of generated ones")
+    parser.add_argument("--events", type=int, default=100_000, help="number of generated events")
+    parser.add_argument("--guilds", type=int, default=50)
+    parser.add_argument("--members", type=int, default=2_000)
+    parser.add_argument("--counting-share", type=float, default=0.3, help="share of events that are counting messages")
+    parser.add_argument("--rate", type=float, default=0, help="events per second, 0 replays as fast as possible")
+    parser.add_argument("--flush-every", type=int, default=10_000, help="events between two timed flushes")
+    parser.add_argument("--resolution", type=int, default=60, help="Seen's resolution in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(results))
+    else:
+        for key, value in results.items():
+            print(f"{key:>18}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import asyncio
+import contextlib
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+import discord
+
+log = logging.getLogger("red.rustypredator.counting")
+
+# gets the payloads of every submission that was merged into one run
+Action = Callable[[List[Any]], Awaitable[None]]
+
+
+class ActionQueue:
+    """Runs Discord side effects in the background, so the caller doesn't wait for the API.
+
+    Submissions with the same key that are still waiting are merged into one run that gets
+    all their payloads, so a storm of fails in one channel sends one notice instead of many.
+    Different keys run concurrently. When Discord rate limits an action the whole queue pauses
+    and the action is retried with an exponential backoff.
+    """
+
+    def __init__(self, concurrency: int = 4, retries: int = 3, backoff: float = 1.0):
+        self.retries = retries
+        self.backoff = backoff
+        self._semaphore = asyncio.Semaphore(concurrency)
+        # key -> (action, payloads) of submissions that haven't started yet, in submission order
+        self._pending: Dict[Hashable, tuple] = {}
+        self._wakeup = asyncio.Event()
+        # loop time before which nothing is started, set by rate limits
+        self._resume_at = 0.0
+        self._running = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._dispatch())
+
+    async def close(self):
+        """Stop taking new work, but let everything that was already submitted finish."""
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        while self._pending:
+            key, (action, payloads) = self._pending.popitem()
+            self._running.add(asyncio.create_task(self._run(key, action, payloads)))
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def submit(self, key: Hashable, action: Action, payload: Any = None):
+        pending = self._pending.get(key)
+        if pending is not None:
+            pending[1].append(payload)
+            return
+        self._pending[key] = (action, [payload])
+        self._wakeup.set()
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._pending:
+                delay = self._resume_at - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue
+                # merging keeps working while an action waits for a free slot
+                await self._semaphore.acquire()
+                if not self._pending:
+                    self._semaphore.release()
+                    break
+                key = next(iter(self._pending))
+                action, payloads = self._pending.pop(key)
+                task = asyncio.create_task(self._run(key, action, payloads, acquired=True))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+
+    async def _run(self, key: Hashable, action: Action, payloads: List[Any], acquired: bool = False):
+        if not acquired:
+            await self._semaphore.acquire()
+        loop = asyncio.get_running_loop()
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    await action(payloads)
+                    return
+                except discord.HTTPException as e:
+                    if e.status != 429 or attempt == self.retries:
+                        raise
+                    delay = self.backoff * 2 ** attempt
+                    self._resume_at = max(self._resume_at, loop.time() + delay)
+                    log.debug("Rate limited while running %r, retrying in %.1fs.", key, delay)
+                    await asyncio.sleep(delay)
+        except Exception:
+            log.exception("Failed to run the counting action %r.", key)
+        finally:
+            self._semaphore.release()
@@ -1,41 +1,361 @@
+import asyncio
+import contextlib
+import logging
 import random
+import time
+from collections import defaultdict
+from typing import Literal, Optional
 from redbot.core import commands
 from redbot.core.bot import Red
 from redbot.core.config import Config
+from redbot.core.data_manager import cog_data_path
+from redbot.core.utils.chat_formatting import box, pagify
 import discord
 
+from . import i18n, parser
+from .actions import ActionQueue
+from .game import CountingGame, LeaderboardIndex, new_leaderboard_entry
+from .metrics import Metrics, timed
+from .stats import StatsStore, new_member_stats
+
+log = logging.getLogger("red.rustypredator.counting")
+
+
 class Counting(commands.Cog):
-    """Cog for a counting game with leaderboards, custom reactions, per-guild configuration, and optional shame role."""
-
-    lang = {
-        "en": {
-            "general": {
-                "countingTwiceMsg1": "You tried to count twice in a row."
-            }
-        },
-        "de": {
-            "general": {
-                "countingTwiceMsg1": "Du hast versucht zwei mal zu zählen."
-            }
-        }
-    }
+    """Cog for counting games in one or more channels per guild, with leaderboards, custom reactions, per-channel rules, and optional shame role."""
 
     default_guild = {
-        "current_number": 0,
-        "channel_id": None,
-        "leaderboard": {},
         "shame_role": None,
-        "last_counter_id": None,
+        "participate_in_global_lb": False,
+        "language": i18n.DEFAULT_LANGUAGE,
+        # channel_id -> rules and "enabled" of every channel that is or was a counting channel.
+        # They live with the guild's settings, so countingset changes both in a single write
+        "channels": {}
+    }
+
+    # the rules every counting channel has on its own
+    default_rules = {
         "fail_on_text": False,
         "ban_from_counting_after_fail": False,
-        "participate_in_global_lb": False,
-        "allow_consecutive_counting": False
+        "allow_consecutive_counting": False,
+        "allow_expressions": False,
+        "reset_on_fail": False
+    }
+
+    # every counting game lives in its own channel, with its own number and leaderboard
+    default_channel = {
+        "current_number": 0,
+        "last_counter_id": None,
+        "leaderboard": {},
+        # how far a rebuild from the channel history got, so it can resume
+        "rebuild_checkpoint": None
+    }
+
+    # the per-guild game of schema version 1, moved to the channel scope by _migrate_to_channels
+    legacy_guild_keys = (
+        "channel_id",
+        "current_number",
+        "last_counter_id",
+        "leaderboard",
+        "fail_on_text",
+        "ban_from_counting_after_fail",
+        "allow_consecutive_counting",
+        "allow_expressions",
+        "rebuild_checkpoint"
+    )
+    schema_version = 4
+
+    # seconds between two saves of the game state, and the number of changed leaderboard
+    # entries of one game that triggers a save right away
+    save_interval = 10
+    save_batch_size = 50
+    # a save that changes up to this many keys of a scope writes them one by one, a bigger one
+    # writes the scope in a single transaction, as every write rewrites the whole file on Red's JSON backend
+    save_write_limit = 5
+    leaderboard_page_size = 10
+    # messages between two checkpoints and two progress updates of a rebuild
+    rebuild_checkpoint_interval = 5000
+    rebuild_progress_interval = 1000
+
+    # names countingset uses for settings that are stored under another key
+    setting_aliases = {
+        "shamerole": "shame_role"
     }
 
+    # the settings of a guild, and the rules every counting channel has on its own
+    guild_setting_keys = (
+        "shame_role",
+        "participate_in_global_lb",
+        "language"
+    )
+    channel_setting_keys = tuple(default_rules)
+
     def __init__(self, bot: Red):
         self.bot = bot
         self.config = Config.get_conf(self, identifier=19516548596, force_registration=True)
         self.config.register_guild(**self.default_guild)
+        self.config.register_channel(**self.default_channel)
+        # user_id -> summed count of all guilds that participate in the global leaderboard
+        self.config.register_global(global_leaderboard={}, schema_version=1)
+        # counts, fails and streaks of each member, apart from the leaderboard so it stays small
+        self.config.register_member(**new_member_stats())
+        # guild_id -> cached guild settings, channel_id -> cached rules and guild of a counting channel
+        self._guild_settings = {}
+        self._channel_settings = {}
+        # channel_id -> live game state of every counting channel, written to config in batches
+        # by _save_games, on_message routes through it without reading config
+        self._games = {}
+        self._channel_locks = defaultdict(asyncio.Lock)
+        self._save_now = asyncio.Event()
+        self._save_task = None
+        self._save_lock = asyncio.Lock()
+        # channel_id -> running history rebuild
+        self._rebuild_tasks = {}
+        self._global_ranking = LeaderboardIndex()
+        self._global_dirty = set()
+        self._global_rebuild_task = None
+        # reactions, fail notices and shame roles, sent in the background
+        self._actions = ActionQueue()
+        self._stats = StatsStore(self.config, write_limit=self.save_write_limit)
+        self._last_save_at = None
+        self._metrics = Metrics("red_counting")
+        self._metrics.count_config_calls(self.config)
+        self._metrics.gauge("games", lambda: len(self._games))
+        self._metrics.gauge("dirty_games", lambda: sum(game.dirty for game in self._games.values()))
+        self._metrics.gauge("pending_leaderboard_entries", lambda: sum(len(game.dirty_users) for game in self._games.values()))
+        self._metrics.gauge("pending_global_entries", lambda: len(self._global_dirty))
+        self._metrics.gauge("pending_member_stats", lambda: len(self._stats))
+        self._metrics.gauge("queued_actions", lambda: len(self._actions))
+        self._metrics.gauge("save_lag_seconds", lambda: round(time.time() - self._last_save_at) if self._last_save_at else -1)
+
+    async def cog_load(self):
+        schema_version = await self.config.schema_version()
+        if schema_version < 2:
+            await self._migrate_to_channels()
+        if schema_version < 3:
+            await self._migrate_rules_to_guilds()
+        all_channels = await self.config.all_channels()
+        for guild_id, guild_config in (await self.config.all_guilds()).items():
+            self._cache_guild_settings(guild_id, guild_config)
+            for channel_id, rules in guild_config["channels"].items():
+                if rules["enabled"]:
+                    channel_id = int(channel_id)
+                    channel_config = all_channels.get(channel_id) or await self.config.channel_from_id(channel_id).all()
+                    self._add_game(channel_id, guild_id, rules, channel_config)
+        self._global_ranking = LeaderboardIndex(await self.config.global_leaderboard())
+        if schema_version < 4:
+            # data from before the global leaderboard has no aggregate of it yet
+            self._rebuild_global_leaderboard(schema_version=4)
+        self._save_task = asyncio.create_task(self._save_loop())
+        self._actions.start()
+
+    async def cog_unload(self):
+        if self._save_task is not None:
+            self._save_task.cancel()
+        if self._global_rebuild_task is not None:
+            self._global_rebuild_task.cancel()
+        # rebuilds resume from their checkpoint after the next load
+        for task in self._rebuild_tasks.values():
+            task.cancel()
+        # nothing may be lost on unload, so write everything that is still pending
+        await self._save_games()
+        await self._actions.close()
+
+    async def red_delete_data_for_user(self, *, requester: Literal["discord", "owner", "user", "user_strict"], user_id: int):
+        # the member stats are not needed to run a game, so they go for every kind of request.
+        # Holding the save lock keeps a running save from writing them back
+        async with self._save_lock:
+            self._stats.forget(user_id)
+            async with self.config._get_base_group(self.config.MEMBER).all() as members:
+                for guild_id in list(members):
+                    members[guild_id].pop(str(user_id), None)
+                    if not members[guild_id]:
+                        del members[guild_id]
+
+    async def _migrate_to_channels(self):
+        """Move the single game of every guild from the guild scope into the scope of its channel."""
+        for guild_id, guild_config in (await self.config.all_guilds()).items():
+            channel_id = guild_config.get("channel_id")
+            if channel_id is not None:
+                async with self.config.channel_from_id(channel_id).all() as channel_data:
+                    channel_data["guild_id"] = guild_id
+                    channel_data["enabled"] = True
+                    for key in self.legacy_guild_keys:
+                        if key != "channel_id" and key in guild_config:
+                            channel_data[key] = guild_config[key]
+            group = self.config.guild_from_id(guild_id)
+            for key in self.legacy_guild_keys:
+                if key in guild_config:
+                    await group.clear_raw(key)
+        await self.config.schema_version.set(2)
+        log.info("Moved the counting games into the channel scope.")
+
+    async def _migrate_rules_to_guilds(self):
+        """Move the rules of every counting channel from the channel scope into the channels map of its guild."""
+        rule_keys = ("enabled",) + self.channel_setting_keys
+        # read raw, the channel scope doesn't register these keys anymore
+        channel_scope = self.config._get_base_group(self.config.CHANNEL)
+        guild_channels = {}
+        for channel_id, channel_data in (await channel_scope.all()).items():
+            if channel_data.get("guild_id") is not None:
+                rules = {"enabled": False, **self.default_rules}
+                rules.update((key, channel_data[key]) for key in rule_keys if key in channel_data)
+                guild_channels.setdefault(channel_data["guild_id"], {})[channel_id] = rules
+        for guild_id, channels in guild_channels.items():
+            async with self.config.guild_from_id(guild_id).channels() as guild_data:
+                guild_data.update(channels)
+        async with channel_scope.all() as channel_data:
+            for data in channel_data.values():
+                for key in ("guild_id",) + rule_keys:
+                    data.pop(key, None)
+        await self.config.schema_version.set(3)
+        log.info("Moved the rules of the counting channels into the guild scope.")
+
+    def _add_game(self, channel_id, guild_id, rules, channel_config):
+        self._games[channel_id] = CountingGame.from_config(channel_config)
+        self._cache_channel_settings(channel_id, guild_id, rules)
+
+    def _game_channel(self, ctx, channel=None):
+        """The counting channel a command is about: the given one, the current one, or the only one of the guild."""
+        if channel is not None:
+            return channel if channel.id in self._games else None
+        if ctx.channel.id in self._games:
+            return ctx.channel
+        if ctx.guild is not None:
+            channel_ids = [channel_id for channel_id, settings in self._channel_settings.items() if settings["guild_id"] == ctx.guild.id]
+            if len(channel_ids) == 1:
+                return ctx.guild.get_channel(channel_ids[0])
+        return None
+
+    def _schedule_save(self, game: CountingGame):
+        """Save soon if a game collected a lot of changes, otherwise the next periodic save picks them up."""
+        if len(game.dirty_users) >= self.save_batch_size or len(self._stats) >= self.save_batch_size:
+            self._save_now.set()
+
+    async def _save_loop(self):
+        with contextlib.suppress(asyncio.CancelledError):
+            while True:
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._save_now.wait(), timeout=self.save_interval)
+                self._save_now.clear()
+                try:
+                    await self._save_games()
+                except Exception:
+                    self._metrics.inc("save_errors")
+                    log.exception("Failed to save the counting games, retrying on the next run.")
+
+    async def _save_games(self):
+        """Write the changes of every game since the last save, only touching changed leaderboard entries."""
+        # a rebuild replaces a game in between, it must not be overwritten by an older save
+        async with self._save_lock:
+            start = time.perf_counter()
+            await self._write_changes()
+            self._metrics.observe("save", time.perf_counter() - start)
+            self._last_save_at = time.time()
+
+    async def _write_changes(self):
+        changes = {
+            channel_id: (game, *game.take_changes()) for channel_id, game in list(self._games.items()) if game.dirty
+        }
+        try:
+            if sum(len(entries) + (2 if state else 0) for _, state, entries in changes.values()) <= self.save_write_limit:
+                for channel_id, (game, state, entries) in list(changes.items()):
+                    group = self.config.channel_from_id(channel_id)
+                    if state is not None:
+                        await group.current_number.set(state[0])
+                        await group.last_counter_id.set(state[1])
+                    for user_id, entry in entries.items():
+                        await group.leaderboard.set_raw(user_id, value=entry)
+                    del changes[channel_id]
+            elif changes:
+                async with self.config._get_base_group(self.config.CHANNEL).all() as channels:
+                    for channel_id, (game, state, entries) in changes.items():
+                        channel = channels.setdefault(str(channel_id), {})
+                        if state is not None:
+                            channel["current_number"], channel["last_counter_id"] = state
+                        channel.setdefault("leaderboard", {}).update(entries)
+                changes = {}
+        except BaseException:
+            # also when the save task gets cancelled during unload, so the final save writes them
+            for game, state, entries in changes.values():
+                game.restore_changes(state, entries)
+            raise
+        global_dirty, self._global_dirty = self._global_dirty, set()
+        try:
+            if len(global_dirty) <= self.save_write_limit:
+                while global_dirty:
+                    user_id = next(iter(global_dirty))
+                    await self.config.global_leaderboard.set_raw(user_id, value=self._global_ranking.get(user_id))
+                    global_dirty.discard(user_id)
+            else:
+                async with self.config.global_leaderboard() as global_leaderboard:
+                    for user_id in global_dirty:
+                        global_leaderboard[user_id] = self._global_ranking.get(user_id)
+                global_dirty = set()
+        except BaseException:
+            self._global_dirty.update(global_dirty)
+            raise
+        await self._stats.save()
+
+    def _rebuild_global_leaderboard(self, schema_version=None):
+        """Recompute the global leaderboard in the background, replacing a rebuild that is still running.
+
+        ``schema_version`` is set once the result is stored, so an interrupted migration rebuilds again.
+        """
+        if self._global_rebuild_task is not None:
+            self._global_rebuild_task.cancel()
+        self._global_rebuild_task = asyncio.create_task(self._rebuild_global_task(schema_version))
+
+    async def _rebuild_global_task(self, schema_version=None):
+        try:
+            # channels that are no counting channel anymore don't count, so their config is final
+            all_guilds = await self.config.all_guilds()
+            all_channels = await self.config.all_channels()
+            counts = {}
+            for done, (guild_id, guild_config) in enumerate(all_guilds.items(), 1):
+                if self._participates(guild_id):
+                    for channel_id in map(int, guild_config["channels"]):
+                        if channel_id not in self._games and channel_id in all_channels:
+                            for user_id, entry in all_channels[channel_id]["leaderboard"].items():
+                                counts[user_id] = counts.get(user_id, 0) + entry['count']
+                if done % 50 == 0:
+                    await asyncio.sleep(0)
+            # live games are added without yielding, so no count can slip between the sum and the swap
+            for channel_id, game in self._games.items():
+                if self._participates(self._channel_settings[channel_id]["guild_id"]):
+                    for user_id, entry in game.leaderboard.items():
+                        counts[user_id] = counts.get(user_id, 0) + entry['count']
+            self._global_ranking = LeaderboardIndex(counts)
+            self._global_dirty = set()
+            await self.config.global_leaderboard.set(counts)
+            if schema_version is not None:
+                await self.config.schema_version.set(schema_version)
+            log.info("Rebuilt the global counting leaderboard with %d users.", len(counts))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            log.exception("Failed to rebuild the global counting leaderboard.")
+
+    def _participates(self, guild_id):
+        return self.strToBool(self._guild_settings.get(guild_id, {}).get("participate_in_global_lb"))
+
+    def _cache_guild_settings(self, guild_id, guild_config):
+        """Remember the settings of a guild, so on_message doesn't have to read them from config."""
+        self._guild_settings[guild_id] = {key: guild_config[key] for key in self.guild_setting_keys}
+
+    def _cache_channel_settings(self, channel_id, guild_id, rules):
+        self._channel_settings[channel_id] = {key: rules.get(key, default) for key, default in self.default_rules.items()}
+        self._channel_settings[channel_id]["guild_id"] = guild_id
+
+    async def _refresh_settings(self, guild):
+        guild_config = await self.config.guild(guild).all()
+        self._cache_guild_settings(guild.id, guild_config)
+        for channel_id, rules in guild_config["channels"].items():
+            if int(channel_id) in self._games:
+                self._cache_channel_settings(int(channel_id), guild.id, rules)
+
+    async def _set_rule(self, channel, key, value):
+        await self.config.guild(channel.guild).set_raw("channels", str(channel.id), key, value=value)
 
     @staticmethod
     def strToBool(convertme):
@@ -57,74 +377,88 @@ class Counting(commands.Cog):
         trueKeywords = ['true', '1', 'y', 'yes', 'yeah', 'yup', 'certainly', 'uh-huh']
         return convertme.lower() in trueKeywords
     
-    @staticmethod
-    def isNumber(str):
-        try:
-            float(str)
-        except ValueError:
-            return False
-        return True
+    def _locale(self, guild) -> i18n.Locale:
+        return i18n.get_locale(self._guild_settings.get(guild.id, {}).get("language"))
 
-    async def failed(why, message, guildConfig, lang, banFromCountingAfterFail):
+    def failed(self, why, message, game: CountingGame, settings):
+        """Queue everything that happens to a wrong count and return wether the game has to be reset.
+
+        Only the queueing happens here, the Discord calls run in the background.
+        """
         # Why Array:
         # 1: Text in COunting Channel
         # 2: Consecutive Counting
         # 3: Wrong Number
 
-        # wether or not the counter needs to be reset...
-        reset = False
+        # whether a fail ends the current round is a rule of the channel
+        reset = self.strToBool(settings['reset_on_fail'])
 
         # mark message as wrong
-        await message.add_reaction("❌")
-
-        display_name = message.author.display_name
-        correct_number = guildConfig["current_number"] + 1
-
-        roasts = {
-            "en": [
-                f"{display_name} could'nt even count to {correct_number}! Maybe try using your fingers next time?",
-                f"Looks like {display_name} skipped a few math classes... Back to square one!",
-                f"{display_name}, is that your final answer? Because it's definitely wrong!",
-                f"{display_name}'s counting skills are as impressive as their ability to divide by zero.",
-                f"{display_name}, are you sure you're not a calculator in disguise? Because your math is off!"
-            ],
-            "de": [
-                f"{display_name}, Du bist der Grund, warum Taschenrechner erfunden wurden.",
-            ]
-        }
-        
-        title = ":bell: :bell: Shame!, Shame! :bell: :bell:"
-        color = discord.Color.red()
-        failmsg = "bleh"
-        
-        match why:
-            case 1:
-                failmsg = "Text is not allowed here."
-            case 2:
-                failmsg = "You cant count twice!"
-            case 3:
-                channel = message.channel
-                # roast them!
-                roast = random.choice(roasts[lang])
-                await channel.send(embed=discord.Embed(description=roast, color=discord.Color.red()))
-        
-        # send message
-        await message.channel.send(embed=discord.Embed(title=title, description=failmsg, color=color))
-        
+        self._actions.submit(("reaction", message.id), self._react, (message, "❌"))
+
+        locale = self._locale(message.guild)
+        if why == 3:
+            # roast them!
+            roast = random.choice(locale.roasts).format(
+                display_name=message.author.display_name, correct_number=game.current_number + 1
+            )
+        else:
+            roast = None
+        # fails in the same channel that are still waiting get one notice together
+        self._actions.submit(("notice", message.channel.id), self._send_fail_notice, (message.channel, why, roast, locale))
+
         # do logic to the user who failed! apply role etc.
-        if guildConfig["shame_role"]:
-            shame_role = message.guild.get_role(guildConfig["shame_role"])
-            await message.author.add_roles(shame_role, reason="Wrong count or double counting")
-        if banFromCountingAfterFail:
-            await message.channel.set_permissions(shame_role, send_messages=False)
+        shame_role_id = self._guild_settings.get(message.guild.id, {}).get("shame_role")
+        if shame_role_id:
+            shame_role = message.guild.get_role(shame_role_id)
+            if shame_role is not None:
+                self._actions.submit(("shame", message.guild.id, message.author.id), self._add_shame_role, (message.author, shame_role))
+                if self.strToBool(settings['ban_from_counting_after_fail']):
+                    self._actions.submit(("ban", message.channel.id, shame_role.id), self._ban_shame_role, (message.channel, shame_role))
         return reset
 
+    @staticmethod
+    async def _react(payloads):
+        message, emoji = payloads[0]
+        await message.add_reaction(emoji)
+
+    @staticmethod
+    async def _send_fail_notice(payloads):
+        channel, _why, _roast, locale = payloads[-1]
+        # the roast of the last wrong number, the rest would only be noise
+        roasts = [roast for _channel, _why, roast, _locale in payloads if roast is not None]
+        if roasts:
+            await channel.send(embed=locale.roast_embed(roasts[-1]))
+        reasons = dict.fromkeys(why for _channel, why, _roast, _locale in payloads)
+        await channel.send(embed=locale.fail_embed(reasons, len(payloads)))
+
+    @staticmethod
+    async def _add_shame_role(payloads):
+        member, shame_role = payloads[0]
+        await member.add_roles(shame_role, reason="Wrong count or double counting")
+
+    @staticmethod
+    async def _ban_shame_role(payloads):
+        channel, shame_role = payloads[0]
+        await channel.set_permissions(shame_role, send_messages=False)
+
     @commands.guild_only()
     @commands.command()
     async def countingset(self, ctx, setting = None, *parameters):
-        """Aggregator Command for configuring all settings of the bot"""
+        """Aggregator Command for configuring all settings of the bot
+
+        Several settings can be changed at once with `setting=value` pairs.
+        """
         guild = ctx.guild
-        guildcfg = self.config.guild(guild).all()
+        if setting is not None and "=" in setting:
+            await self._set_many(ctx, (setting,) + parameters)
+            return
+        rebuild_global = False
+        # the rules belong to one counting channel, the one the command is used in if there are several
+        target = self._game_channel(ctx)
+        if setting in self.channel_setting_keys and target is None:
+            await ctx.send("Use this command in the counting channel you want to change, or pass `channel=#channel` with the setting.")
+            return
         
         match setting:
             case 'channel':
@@ -140,11 +474,31 @@ class Counting(commands.Cog):
                     channel = ctx.channel
                     await ctx.send("No Channel defined, using the channel the command was sent from.")
                 # TODO: check if channel exists
-                # Set the Channel:
-                await self.config.guild(guild).channel_id.set(channel.id)
+                # Add the Channel:
+                await self._enable_channel(channel)
+                target = channel
                 
                 # Prepare message
-                msg = "Counting Channel set to: " + str(channel.mention)
+                msg = "Counting Channel added: " + str(channel.mention)
+                color = discord.Color.green()
+            case 'removechannel':
+                title = "Setting: Remove Channel"
+                
+                if len(parameters) > 0:
+                    try:
+                        channel = await commands.TextChannelConverter().convert(ctx, parameters[0])
+                    except discord.ext.commands.errors.ChannelNotFound:
+                        await ctx.send("Mentioned channel was not found.")
+                        return
+                else:
+                    channel = ctx.channel
+                if channel.id not in self._games:
+                    await ctx.send(channel.mention + " is no counting channel.")
+                    return
+                await self._disable_channel(channel)
+                target = None
+                
+                msg = "Counting Channel removed: " + str(channel.mention) + ". Its leaderboard is kept."
                 color = discord.Color.green()
             case 'shamerole':
                 title = "Setting: Shamerole"
@@ -173,7 +527,7 @@ class Counting(commands.Cog):
                 if len(parameters) > 0:
                     failOnText = self.strToBool(parameters[0])
                 
-                await self.config.guild(guild).fail_on_text.set(failOnText)
+                await self._set_rule(target, "fail_on_text", failOnText)
                 
                 msg = "Setting fail_on_text to: " + str(failOnText)
                 color = discord.Color.green()
@@ -185,7 +539,7 @@ class Counting(commands.Cog):
                 if len(parameters) > 0:
                     banFromCountingAfterFail = self.strToBool(parameters[0])
                 
-                await self.config.guild(guild).ban_from_counting_after_fail.set(banFromCountingAfterFail)
+                await self._set_rule(target, "ban_from_counting_after_fail", banFromCountingAfterFail)
                                     
                 msg = "Setting ban_from_counting_after_fail to: " + str(banFromCountingAfterFail)
                 color = discord.Color.green()
@@ -197,10 +551,34 @@ class Counting(commands.Cog):
                 if len(parameters) > 0:
                     allowConsecutiveCounting = self.strToBool(parameters[0])
                 
-                await self.config.guild(guild).allow_consecutive_counting.set(allowConsecutiveCounting)
+                await self._set_rule(target, "allow_consecutive_counting", allowConsecutiveCounting)
                                     
                 msg = "Setting allow_consecutive_counting to: " + str(allowConsecutiveCounting)
                 color = discord.Color.green()
+            case 'allow_expressions':
+                title = "Setting Rule: Allow expressions"
+                
+                allowExpressions = False
+                
+                if len(parameters) > 0:
+                    allowExpressions = self.strToBool(parameters[0])
+                
+                await self._set_rule(target, "allow_expressions", allowExpressions)
+                                    
+                msg = "Setting allow_expressions to: " + str(allowExpressions)
+                color = discord.Color.green()
+            case 'reset_on_fail':
+                title = "Setting Rule: Reset on fail"
+                
+                resetOnFail = False
+                
+                if len(parameters) > 0:
+                    resetOnFail = self.strToBool(parameters[0])
+                
+                await self._set_rule(target, "reset_on_fail", resetOnFail)
+                                    
+                msg = "Setting reset_on_fail to: " + str(resetOnFail)
+                color = discord.Color.green()
             case 'participate_in_global_lb':
                 title = "Setting Rule: Ban from counting after fail"
                 
@@ -210,128 +588,384 @@ class Counting(commands.Cog):
                     participateInGlobalLb = self.strToBool(parameters[0])
                 
                 await self.config.guild(guild).participate_in_global_lb.set(participateInGlobalLb)
+                # this guild's counts have to be added to or removed from the aggregate
+                rebuild_global = True
                                     
                 msg = "Setting participate_in_global_lb to: " + str(participateInGlobalLb)
                 color = discord.Color.green()
+            case 'language':
+                title = "Setting: Language"
+                
+                language = parameters[0] if len(parameters) > 0 else i18n.DEFAULT_LANGUAGE
+                if language not in i18n.LOCALES:
+                    await ctx.send("Unknown language. Available languages: " + ", ".join(i18n.LOCALES))
+                    return
+                
+                await self.config.guild(guild).language.set(language)
+                
+                msg = "Setting language to: " + language
+                color = discord.Color.green()
             case _:
                 title = "No Setting or unknown Provided."
-                msg = "Usage:\n```[p]countingset [setting] <parameters>```\n\nYou have the following Options (Current Values displayed after the name):\n"
-                # add options and their values:
-                channel = await self.config.guild(guild).channel_id()
-                #channel = await commands.TextChannelConverter().convert(ctx, channelId)
-                msg += "- channel (" + str(channel) + ")\n"
-                role = await self.config.guild(guild).shame_role()
-                #role = await commands.RoleConverter().convert(ctx, roleId)
-                msg += "- shamerole (" + str(role) + ")\n"
-                msg += "- fail_on_text (" + str(await self.config.guild(guild).fail_on_text()) + ")\n"
-                msg += "- ban_from_counting_after_fail (" + str(await self.config.guild(guild).ban_from_counting_after_fail()) + ")\n"
-                msg += "- allow_consecutive_counting (" + str(await self.config.guild(guild).allow_consecutive_counting()) + ")\n"
-                msg += "- participate_in_global_lb (" + str(await self.config.guild(guild).participate_in_global_lb()) + ")"
+                msg = "Usage:\n```[p]countingset [setting] <parameters>\n[p]countingset setting=value setting=value ...```\n\nYou have the following Options (Current Values displayed after the name):\n"
+                msg += self._settings_summary(guild, target)
                 color = discord.Color.red()
-                    
+
+        await self._refresh_settings(guild)
+        if rebuild_global:
+            self._rebuild_global_leaderboard()
         await ctx.channel.send(embed=discord.Embed(title=title, description=msg, color=color))
 
+    async def _set_many(self, ctx, pairs):
+        """Apply `setting=value` pairs in one write, nothing is changed if one of them is invalid."""
+        guild = ctx.guild
+        target = self._game_channel(ctx)
+        # `channel=#channel` picks the counting channel whose rules are changed, and adds it if it is new
+        add_channel = False
+        guild_changes = {}
+        channel_changes = {}
+        for pair in pairs:
+            key, _sep, value = pair.partition("=")
+            key = self.setting_aliases.get(key, key)
+            try:
+                if key == "channel":
+                    target = await commands.TextChannelConverter().convert(ctx, value)
+                    add_channel = target.id not in self._games
+                elif key in self.channel_setting_keys:
+                    channel_changes[key] = self._parse_bool(value)
+                else:
+                    guild_changes[key] = await self._convert_setting(ctx, key, value)
+            except (commands.BadArgument, ValueError) as e:
+                await ctx.send(embed=discord.Embed(title="Nothing was changed.", description=f"`{pair}`: {e}", color=discord.Color.red()))
+                return
+        if channel_changes and target is None:
+            await ctx.send(embed=discord.Embed(title="Nothing was changed.", description="Pass `channel=#channel` to say which counting channel the rules are for.", color=discord.Color.red()))
+            return
+        # the guild's settings and the rules of its channels are changed in one write
+        async with self.config.guild(guild).all() as guild_data:
+            rebuild_global = "participate_in_global_lb" in guild_changes and guild_changes["participate_in_global_lb"] != self.strToBool(guild_data["participate_in_global_lb"])
+            guild_data.update(guild_changes)
+            if add_channel or channel_changes:
+                rules = guild_data["channels"].setdefault(str(target.id), {"enabled": False, **self.default_rules})
+                rules.update(channel_changes)
+                if add_channel:
+                    rules["enabled"] = True
+        self._cache_guild_settings(guild.id, guild_data)
+        if add_channel:
+            await self._start_game(target, rules)
+        elif channel_changes:
+            self._cache_channel_settings(target.id, guild.id, rules)
+        if rebuild_global:
+            self._rebuild_global_leaderboard()
+        changes = list(guild_changes) + list(channel_changes) + (["channel"] if add_channel else [])
+        msg = "Changed " + ", ".join(changes) + ".\n\n" + self._settings_summary(guild, target)
+        await ctx.channel.send(embed=discord.Embed(title="Settings updated", description=msg, color=discord.Color.green()))
+
+    async def _convert_setting(self, ctx, key, value):
+        if key == "shame_role":
+            if value.lower() in ("", "none"):
+                return None
+            return (await commands.RoleConverter().convert(ctx, value)).id
+        if key == "language":
+            if value not in i18n.LOCALES:
+                raise ValueError("available languages are " + ", ".join(i18n.LOCALES))
+            return value
+        if key in self.guild_setting_keys:
+            return self._parse_bool(value)
+        raise ValueError("unknown setting")
+
+    def _parse_bool(self, value):
+        """Parse a boolean setting, unlike strToBool anything that is neither true nor false is an error."""
+        if self.strToBool(value):
+            return True
+        if value.lower() in ['false', '0', 'n', 'no', 'nope']:
+            return False
+        raise ValueError("expected true or false")
+
+    async def _enable_channel(self, channel):
+        """Start a counting game in a channel, or continue the one it had before it was removed."""
+        async with self.config.guild(channel.guild).channels() as channels:
+            rules = channels.setdefault(str(channel.id), {"enabled": False, **self.default_rules})
+            rules["enabled"] = True
+        if channel.id not in self._games:
+            await self._start_game(channel, rules)
+
+    async def _start_game(self, channel, rules):
+        self._add_game(channel.id, channel.guild.id, rules, await self.config.channel(channel).all())
+        # a channel that was a counting channel before brings its old leaderboard back
+        if self._participates(channel.guild.id):
+            self._rebuild_global_leaderboard()
+
+    async def _disable_channel(self, channel):
+        # counts that come in meanwhile wait for the lock, and find no game anymore afterwards
+        async with self._channel_locks[channel.id]:
+            await self._set_rule(channel, "enabled", False)
+            await self._save_games()
+            self._games.pop(channel.id, None)
+            self._channel_settings.pop(channel.id, None)
+        if self._participates(channel.guild.id):
+            self._rebuild_global_leaderboard()
+
+    def _settings_summary(self, guild, channel=None):
+        """List every setting with its current value, from the cached settings without reading config."""
+        settings = self._guild_settings.get(guild.id) or {key: self.default_guild[key] for key in self.guild_setting_keys}
+        channels = [guild.get_channel(channel_id) for channel_id, rules in self._channel_settings.items() if rules["guild_id"] == guild.id]
+        role = guild.get_role(settings["shame_role"]) if settings["shame_role"] else None
+        msg = "- channel (" + (", ".join(c.mention for c in channels if c is not None) or "None") + ")\n"
+        msg += "- shamerole (" + (role.mention if role else str(settings["shame_role"])) + ")\n"
+        msg += "- participate_in_global_lb (" + str(settings["participate_in_global_lb"]) + ")\n"
+        msg += "- language (" + str(settings["language"]) + ")\n"
+        if channel is None or channel.id not in self._channel_settings:
+            msg += "\nThe rules are set per counting channel, use this command in one to see them."
+            return msg
+        rules = self._channel_settings[channel.id]
+        msg += "\nRules of " + channel.mention + ":\n"
+        for key in self.channel_setting_keys:
+            msg += "- " + key + " (" + str(rules[key]) + ")\n"
+        return msg
+
+    @commands.guild_only()
+    @commands.admin_or_permissions(manage_guild=True)
+    @commands.command()
+    async def countingrebuild(self, ctx, channel: Optional[discord.TextChannel] = None, fresh: bool = False):
+        """Recount a game from the history of its counting channel.
+
+        An interrupted rebuild continues where it stopped, unless `fresh` is true.
+        The current rules are applied to every message.
+        """
+        channel = self._game_channel(ctx, channel)
+        if channel is None:
+            await ctx.send("There is no counting game in this channel.")
+            return
+        task = self._rebuild_tasks.get(channel.id)
+        if task is not None and not task.done():
+            await ctx.send("A rebuild is already running.")
+            return
+        if fresh:
+            await self.config.channel(channel).rebuild_checkpoint.set(None)
+        progress = await ctx.send("Rebuilding the counting game from " + channel.mention + "...")
+        self._rebuild_tasks[channel.id] = asyncio.create_task(self._rebuild_from_history(channel, progress))
+
+    async def _rebuild_from_history(self, channel, progress):
+        guild = channel.guild
+        group = self.config.channel(channel)
+        checkpoint = await group.rebuild_checkpoint()
+        if checkpoint is None or checkpoint["channel_id"] != channel.id:
+            checkpoint = {"channel_id": channel.id, "message_id": None, "scanned": 0,
+                          "current_number": 0, "last_counter_id": None, "counts": {}}
+        # only the counts are replayed, that keeps the memory at one number per counter
+        replay = CountingGame(checkpoint["current_number"], checkpoint["last_counter_id"],
+                              {user_id: {'count': count} for user_id, count in checkpoint["counts"].items()})
+        scanned = checkpoint["scanned"]
+        # the rules as they were when the rebuild started
+        rules = self._channel_settings[channel.id]
+        after = discord.Object(checkpoint["message_id"]) if checkpoint["message_id"] else None
+
+        async def report(content):
+            # a deleted progress message must not stop the rebuild
+            with contextlib.suppress(discord.HTTPException):
+                await progress.edit(content=content)
+
+        async def replay_history(after):
+            nonlocal scanned
+            async for message in channel.history(limit=None, after=after, oldest_first=True):
+                scanned += 1
+                if not message.author.bot:
+                    # fails reset the round if the rule says so, like failed() decides for live counts
+                    if self._judge(replay, message, rules) not in (None, 0) and self.strToBool(rules['reset_on_fail']):
+                        replay.reset()
+                checkpoint["message_id"] = message.id
+                if scanned % self.rebuild_checkpoint_interval == 0:
+                    checkpoint.update(scanned=scanned, current_number=replay.current_number,
+                                      last_counter_id=replay.last_counter_id,
+                                      counts={user_id: entry['count'] for user_id, entry in replay.leaderboard.items()})
+                    await group.rebuild_checkpoint.set(checkpoint)
+                if scanned % self.rebuild_progress_interval == 0:
+                    await report(f"Rebuilding the counting game... {scanned} messages replayed, at {replay.current_number}.")
+
+        try:
+            await replay_history(after)
+            # the lock keeps new counts out while the last messages are replayed and the game is swapped
+            async with self._channel_locks[channel.id], self._save_lock:
+                last = checkpoint["message_id"]
+                await replay_history(discord.Object(last) if last else None)
+                async with group.all() as channel_data:
+                    channel_data["current_number"] = replay.current_number
+                    channel_data["last_counter_id"] = replay.last_counter_id
+                    leaderboard = {}
+                    for user_id, entry in replay.leaderboard.items():
+                        # the other fields of an entry are kept, only the count is recounted
+                        leaderboard[user_id] = {**channel_data["leaderboard"].get(user_id, new_leaderboard_entry()), 'count': entry['count']}
+                    channel_data["leaderboard"] = leaderboard
+                    channel_data["rebuild_checkpoint"] = None
+                    if channel.id in self._games:
+                        self._games[channel.id] = CountingGame.from_config(channel_data)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            log.exception("Failed to rebuild the counting game of channel %s from its history.", channel.id)
+            await report(f"The rebuild stopped after {scanned} messages, run it again to continue.")
+            return
+        if self._participates(guild.id):
+            self._rebuild_global_leaderboard()
+        await report(f"Rebuilt the counting game from {scanned} messages, the current number is {replay.current_number}.")
+
+    @commands.guild_only()
     @commands.command()
-    async def currentnumber(self, ctx):
+    async def currentnumber(self, ctx, channel: Optional[discord.TextChannel] = None):
         """Displays the current number in the counting game."""
-        current_number = await self.config.guild(ctx.guild).current_number()
-        await ctx.send(f"The current number is: {current_number}")
-
-    @commands.command(aliases=["countingboard", "countingleaderboard"])
-    async def countinglb(self, ctx):
-        """Displays the leaderboard in an embed."""
-        leaderboard = await self.config.guild(ctx.guild).leaderboard()
-        if leaderboard:
-            sorted_leaderboard = sorted(leaderboard.items(), key=lambda item: item[1], reverse=True)
-            embed = discord.Embed(title="Counting Game Leaderboard", color=discord.Color.blue())
-            for user_id, score in sorted_leaderboard[:10]:  # Show top 10
-                user = self.bot.get_user(int(user_id))
-                embed.add_field(name=user.name, value=score, inline=False)
-            await ctx.send(embed=embed)
-        else:
-            await ctx.send("The leaderboard is empty.")
+        channel = self._game_channel(ctx, channel)
+        if channel is None:
+            await ctx.send("There is no counting game in this channel.")
+            return
+        current_number = self._games[channel.id].current_number
+        await ctx.send(self._locale(ctx.guild).get("current_number", number=current_number))
+
+    @commands.guild_only()
+    @commands.group(aliases=["countingboard", "countingleaderboard"], invoke_without_command=True)
+    async def countinglb(self, ctx, channel: Optional[discord.TextChannel] = None, page: int = 1):
+        """Displays the leaderboard of a counting channel in an embed, 10 users per page."""
+        channel = self._game_channel(ctx, channel)
+        if channel is None:
+            await ctx.send("There is no counting game in this channel.")
+            return
+        ranking = self._games[channel.id].ranking
+        await self._send_leaderboard(ctx, ranking, page, self._locale(ctx.guild).get("leaderboard_title", channel=channel.name))
+
+    @countinglb.command(name="global")
+    async def countinglb_global(self, ctx, page: int = 1):
+        """Displays the leaderboard of all participating servers combined."""
+        await self._send_leaderboard(ctx, self._global_ranking, page, self._locale(ctx.guild).get("global_leaderboard_title"))
+
+    async def _send_leaderboard(self, ctx, ranking: LeaderboardIndex, page: int, title: str):
+        if not len(ranking):
+            await ctx.send(self._locale(ctx.guild).get("leaderboard_empty"))
+            return
+        pages = (len(ranking) - 1) // self.leaderboard_page_size + 1
+        page = min(max(page, 1), pages)
+        lines = []
+        for rank, user_id, count in ranking.page((page - 1) * self.leaderboard_page_size, self.leaderboard_page_size):
+            lines.append(f"**{rank}.** {self._display_name(ctx.guild, user_id)}: {count}")
+        embed = discord.Embed(title=title, description="\n".join(lines), color=discord.Color.blue())
+        footer = f"Page {page}/{pages}"
+        own_rank = ranking.rank(str(ctx.author.id))
+        if own_rank is not None:
+            footer += f" | Your rank: {own_rank}"
+        embed.set_footer(text=footer)
+        await ctx.send(embed=embed)
+
+    @commands.guild_only()
+    @commands.command()
+    async def countingstats(self, ctx, member: discord.Member = None):
+        """Displays the counting stats of a member, or your own."""
+        member = member or ctx.author
+        stats = await self._stats.get(ctx.guild.id, member.id)
+        embed = discord.Embed(title=f"Counting Stats of {member.display_name}", color=discord.Color.blue())
+        embed.add_field(name="Counts", value=str(stats["counts"]))
+        embed.add_field(name="Fails", value=str(stats["fails"]))
+        embed.add_field(name="Highest Number", value=str(stats["pb"]))
+        embed.add_field(name="Current Streak", value=str(stats["streak"]))
+        embed.add_field(name="Best Streak", value=str(stats["best_streak"]))
+        reasons = {1: "Text", 2: "Counted twice", 3: "Wrong number"}
+        lines = []
+        for timestamp, why, correct_number in reversed(stats["recent_fails"]):
+            lines.append(f"<t:{timestamp}:R> {reasons.get(why, 'Unknown')}, expected {correct_number}")
+        embed.add_field(name="Recent Fails", value="\n".join(lines) or "None", inline=False)
+        await ctx.send(embed=embed)
+
+    @commands.is_owner()
+    @commands.command()
+    async def countingcogstats(self, ctx, export: bool = False):
+        """Show the runtime metrics of Counting, or write them to a file in Prometheus format."""
+        if export:
+            path = cog_data_path(self) / "metrics.prom"
+            tmp = path.with_suffix(".tmp")
+            tmp.write_text(self._metrics.render(), encoding="utf-8")
+            tmp.replace(path)
+            await ctx.send(f"Wrote the metrics to `{path}`.")
+            return
+        for page in pagify("\n".join(self._metrics.summary())):
+            await ctx.send(box(page))
+
+    def _display_name(self, guild, user_id):
+        """Name of a leaderboard user, falling back to a mention for users that aren't cached."""
+        user = guild.get_member(int(user_id)) or self.bot.get_user(int(user_id))
+        if user is None:
+            return f"<@{user_id}>"
+        return discord.utils.escape_markdown(user.display_name)
             
     @commands.Cog.listener()
+    @timed("listener_message")
     async def on_message(self, message):
         """Handles messages in the counting game channel."""
-        if message.author.bot:
+        # most messages are not in a counting channel, this is all they cost
+        if message.channel.id not in self._games:
+            return
+        if message.author.bot or message.guild is None:
             return
 
-        guild_config = await self.config.guild(message.guild).all()
-        
-        if guild_config["channel_id"] == message.channel.id:
-            try:
-                # get settings:
-                failOnText = self.strToBool(guild_config['fail_on_text'])
-                banFromCountingAfterFail = self.strToBool(guild_config['ban_from_counting_after_fail'])
-                allowConsecutiveCounting = self.strToBool(guild_config['allow_consecutive_counting'])
-                #participateInGlobalLb = self.strToBool(guild_config['participate_in_global_lb'])
-                
-                # get current Stats
-                last_number = int(guild_config['current_number'])
-                correct_number = last_number + 1
-                last_counter_id = guild_config['last_counter_id']
-                
-                # get vars for message:
-                next_number = int(message.content)
-                user_id = message.author.id
-                
-                # if fail on text is on, check it first!
-                if failOnText:
-                    if not self.isNumber(message.content):
-                        reset = await self.failed(1, message, banFromCountingAfterFail)
-                        if reset:
-                            # reset counter
-                            await self.config.guild(message.guild).current_number.set(1)
-                            await self.config.guild(message.guild).last_counter_id.set(None)
-                        return
-                
-                # if consecutive counting is forbidden, check this:
-                if not allowConsecutiveCounting:
-                    if user_id == last_counter_id:
-                        reset = await self.failed(2, message, banFromCountingAfterFail)
-                        if reset:
-                            # reset counter
-                            await self.config.guild(message.guild).current_number.set(1)
-                            await self.config.guild(message.guild).last_counter_id.set(None)
-                        return
-                    
-                # check if number is correct:
-                if next_number != correct_number:
-                    reset = await self.failed(3, message, banFromCountingAfterFail)
-                    if reset:
-                        # reset counter
-                        await self.config.guild(message.guild).current_number.set(1)
-                        await self.config.guild(message.guild).last_counter_id.set(None)
-                    return
-                    
-                # update config to reflect new number:
-                await self.config.guild(message.guild).current_number.set(next_number)
-                # update config to reflect current user as last counter:
-                await self.config.guild(message.guild).last_counter_id.set(user_id)
-                # get current leaderboard from config:
-                try:
-                    leaderboard = guild_config["leaderboard"]
-                except:
-                    leaderboard = self.default_guild["leaderboard"]
-                # get users leaderboard entry:
-                try:
-                    llbe = leaderboard.get(str(user_id))
-                    # TODO: Global Leader Board
-                except:
-                    llbe = {
-                        'count': 0,
-                        'failcount': 0,
-                        'pb': 0,
-                        'warnings': {},
-                        'fails': {}
-                    }
-                llbe['count'] = llbe['count'] + 1
-                leaderboard[str(user_id)] = llbe
-                # Write new Leaderboard to config:
-                await self.config.guild(message.guild).leaderboard.set(leaderboard)
-                
+        # messages of a channel are judged one at a time in the order they arrived, so every
+        # message is checked against the state the previous one left behind. Nothing is awaited
+        # before the lock, and stats are recorded without waiting for config
+        async with self._channel_locks[message.channel.id]:
+            game = self._games.get(message.channel.id)
+            if game is None:
+                # the channel was removed while we were waiting
+                return
+            settings = self._channel_settings[message.channel.id]
+            why = self._judge(game, message, settings)
+            if why is None:
+                self._metrics.inc("ignored")
+                return
+            if why == 0:
+                # the game gets written to config with the next save
+                self._schedule_save(game)
+                if self._participates(message.guild.id):
+                    self._global_ranking.increment(str(message.author.id))
+                    self._global_dirty.add(str(message.author.id))
+                self._stats.record_count(message.guild.id, message.author.id, game.current_number)
+                self._metrics.inc("counts")
                 # add a reaction to the messag indicating it was recorded.
-                await message.add_reaction("✅")
-            except ValueError:
-                pass  # Ignore non-numeric messagesuser_id = str(message.author.id)
\ No newline at end of file
+                self._actions.submit(("reaction", message.id), self._react, (message, "✅"))
+                return
+            self._stats.record_fail(message.guild.id, message.author.id, why, game.current_number + 1)
+            self._metrics.inc("fails")
+            # the reset has to happen before the next message is judged, the rest is queued
+            if self.failed(why, message, game, settings):
+                game.reset()
+                self._schedule_save(game)
+
+    def _judge(self, game: CountingGame, message, settings):
+        """Validate a message against the game and count it if it is correct.
+
+        Only the game itself is changed, so a rebuild can replay old messages through it.
+        Returns 0 for a correct count, the reason for `failed` if it is wrong,
+        or None if the message is ignored.
+        """
+        # classify the message first, most messages that are not a number stop here
+        kind, next_number = parser.classify(message.content, self.strToBool(settings['allow_expressions']))
+        if kind != parser.INTEGER:
+            # oversized messages are treated like text
+            if kind != parser.NUMERIC and self.strToBool(settings['fail_on_text']):
+                return 1
+            return None  # Ignore non-numeric messages
+
+        # get settings:
+        allowConsecutiveCounting = self.strToBool(settings['allow_consecutive_counting'])
+        
+        # get current Stats
+        correct_number = game.current_number + 1
+        last_counter_id = game.last_counter_id
+        user_id = message.author.id
+        
+        # if consecutive counting is forbidden, check this:
+        if not allowConsecutiveCounting:
+            if user_id == last_counter_id:
+                return 2
+            
+        # check if number is correct:
+        if next_number != correct_number:
+            return 3
+            
+        game.count(user_id)
+        return 0
@@ -0,0 +1,130 @@
+from typing import Dict, List, Optional, Set, Tuple
+
+
+def new_leaderboard_entry() -> dict:
+    return {
+        'count': 0,
+        'failcount': 0,
+        'pb': 0,
+        'warnings': {},
+        'fails': {}
+    }
+
+
+class LeaderboardIndex:
+    """User IDs ordered by their count, highest first.
+
+    Counts only ever go up by one, so an increment swaps the user with the first user that
+    has the same count and moves the start of that count's block one place down. Increments,
+    ranks and page slices are O(1) and only building the index sorts.
+    """
+
+    def __init__(self, counts: Optional[Dict[str, int]] = None):
+        counts = counts or {}
+        self._count: Dict[str, int] = dict(counts)
+        self._order: List[str] = sorted(counts, key=lambda user_id: -counts[user_id])
+        self._pos: Dict[str, int] = {user_id: pos for pos, user_id in enumerate(self._order)}
+        # count -> position of the first user with that count
+        self._first: Dict[int, int] = {}
+        for pos, user_id in enumerate(self._order):
+            self._first.setdefault(self._count[user_id], pos)
+
+    def __len__(self):
+        return len(self._order)
+
+    def increment(self, user_id: str):
+        if user_id not in self._count:
+            self._count[user_id] = 0
+            self._pos[user_id] = len(self._order)
+            self._order.append(user_id)
+            self._first.setdefault(0, self._pos[user_id])
+        count = self._count[user_id]
+        pos = self._pos[user_id]
+        first = self._first[count]
+        # swap with the first user of the same count
+        other = self._order[first]
+        self._order[first], self._order[pos] = user_id, other
+        self._pos[user_id], self._pos[other] = first, pos
+        # the block of the old count now starts one place later, or is gone
+        if first + 1 < len(self._order) and self._count[self._order[first + 1]] == count:
+            self._first[count] = first + 1
+        else:
+            del self._first[count]
+        self._count[user_id] = count + 1
+        # the user either joins the block right before it or starts a new one
+        self._first.setdefault(count + 1, first)
+
+    def get(self, user_id: str, default=None):
+        return self._count.get(user_id, default)
+
+    def rank(self, user_id: str) -> Optional[int]:
+        """Return the 1-based rank of a user, users with the same count share a rank."""
+        count = self._count.get(user_id)
+        if count is None:
+            return None
+        return self._first[count] + 1
+
+    def page(self, start: int, size: int) -> List[Tuple[int, str, int]]:
+        """Return ``(rank, user_id, count)`` for ``size`` users starting at position ``start``."""
+        return [
+            (self._first[self._count[user_id]] + 1, user_id, self._count[user_id])
+            for user_id in self._order[start : start + size]
+        ]
+
+
+class CountingGame:
+    """Live state of the counting game of one channel.
+
+    The cog is the only writer of this state. Changes are only marked as dirty here and
+    written to config in batches by the cog, touching just the leaderboard entries that changed.
+    """
+
+    def __init__(self, current_number: int = 0, last_counter_id: Optional[int] = None, leaderboard: Optional[Dict[str, dict]] = None):
+        self.current_number = current_number
+        self.last_counter_id = last_counter_id
+        self.leaderboard = leaderboard if leaderboard is not None else {}
+        self.ranking = LeaderboardIndex({user_id: entry['count'] for user_id, entry in self.leaderboard.items()})
+        # whether current_number / last_counter_id changed, and the user IDs whose entry changed
+        self.state_dirty = False
+        self.dirty_users: Set[str] = set()
+
+    @classmethod
+    def from_config(cls, channel_config: dict) -> "CountingGame":
+        return cls(int(channel_config["current_number"]), channel_config["last_counter_id"], channel_config["leaderboard"])
+
+    @property
+    def dirty(self) -> bool:
+        return self.state_dirty or bool(self.dirty_users)
+
+    def count(self, user_id: int) -> dict:
+        """Accept the next number from a user and return their updated leaderboard entry."""
+        self.current_number += 1
+        self.last_counter_id = user_id
+        self.state_dirty = True
+        entry = self.leaderboard.setdefault(str(user_id), new_leaderboard_entry())
+        entry['count'] = entry['count'] + 1
+        self.ranking.increment(str(user_id))
+        self.dirty_users.add(str(user_id))
+        return entry
+
+    def reset(self):
+        self.current_number = 0
+        self.last_counter_id = None
+        self.state_dirty = True
+
+    def take_changes(self):
+        """Return the pending changes as ``(state, {user_id: entry})`` and mark the game as clean.
+
+        ``state`` is None when current_number and last_counter_id didn't change.
+        """
+        state = (self.current_number, self.last_counter_id) if self.state_dirty else None
+        entries = {user_id: self.leaderboard[user_id] for user_id in self.dirty_users}
+        self.state_dirty = False
+        self.dirty_users = set()
+        return state, entries
+
+    def restore_changes(self, state, entries):
+        """Mark changes from :meth:`take_changes` as dirty again after they failed to be written."""
+        if state is not None:
+            self.state_dirty = True
+        self.dirty_users.update(entries)
@@ -0,0 +1,73 @@
+from typing import Dict, Iterable
+
+import discord
+
+DEFAULT_LANGUAGE = "en"
+
+# every language needs the same keys, templates are filled with str.format
+CATALOGS = {
+    "en": {
+        "fail_title": ":bell: :bell: Shame!, Shame! :bell: :bell:",
+        "fail_text": "Text is not allowed here.",
+        "fail_twice": "You cant count twice!",
+        "fail_wrong": "bleh",
+        "fails_merged": "({count} fails)",
+        "current_number": "The current number is: {number}",
+        "leaderboard_title": "Counting Game Leaderboard of #{channel}",
+        "global_leaderboard_title": "Global Counting Game Leaderboard",
+        "leaderboard_empty": "The leaderboard is empty.",
+        "roasts": [
+            "{display_name} could'nt even count to {correct_number}! Maybe try using your fingers next time?",
+            "Looks like {display_name} skipped a few math classes... Back to square one!",
+            "{display_name}, is that your final answer? Because it's definitely wrong!",
+            "{display_name}'s counting skills are as impressive as their ability to divide by zero.",
+            "{display_name}, are you sure you're not a calculator in disguise? Because your math is off!"
+        ]
+    },
+    "de": {
+        "fail_title": ":bell: :bell: Schande!, Schande! :bell: :bell:",
+        "fail_text": "Text ist hier nicht erlaubt.",
+        "fail_twice": "Du hast versucht zwei mal zu zählen.",
+        "fail_wrong": "bleh",
+        "fails_merged": "({count} Fehler)",
+        "current_number": "Die aktuelle Zahl ist: {number}",
+        "leaderboard_title": "Bestenliste des Zählspiels in #{channel}",
+        "global_leaderboard_title": "Globale Bestenliste des Zählspiels",
+        "leaderboard_empty": "Die Bestenliste ist leer.",
+        "roasts": [
+            "{display_name}, Du bist der Grund, warum Taschenrechner erfunden wurden.",
+        ]
+    }
+}
+
+
+class Locale:
+    """The strings of one language, with the embeds that are sent on failures prepared up front."""
+
+    def __init__(self, language: str, catalog: dict):
+        self.language = language
+        self.strings = catalog
+        self.roasts = tuple(catalog["roasts"])
+        self.fail_reasons = {1: catalog["fail_text"], 2: catalog["fail_twice"], 3: catalog["fail_wrong"]}
+        # rendering only copies these and fills in the description
+        self._fail_embed = discord.Embed(title=catalog["fail_title"], color=discord.Color.red()).to_dict()
+        self._roast_embed = discord.Embed(color=discord.Color.red()).to_dict()
+
+    def get(self, key: str, **fields) -> str:
+        return self.strings[key].format(**fields)
+
+    def fail_embed(self, reasons: Iterable[int], count: int) -> discord.Embed:
+        lines = [self.fail_reasons.get(why, self.fail_reasons[3]) for why in reasons]
+        if count > 1:
+            lines.append(self.strings["fails_merged"].format(count=count))
+        return discord.Embed.from_dict({**self._fail_embed, "description": "\n".join(lines)})
+
+    def roast_embed(self, roast: str) -> discord.Embed:
+        return discord.Embed.from_dict({**self._roast_embed, "description": roast})
+
+
+LOCALES: Dict[str, Locale] = {language: Locale(language, catalog) for language, catalog in CATALOGS.items()}
+
+
+def get_locale(language: str) -> Locale:
+    return LOCALES.get(language) or LOCALES[DEFAULT_LANGUAGE]
@@ -0,0 +1,91 @@
+import ast
+import operator
+import re
+from typing import Optional, Tuple
+
+# what a message in the counting channel turned out to be
+INTEGER = 0
+NUMERIC = 1  # a number, but not a whole one (1.5, 1e3, inf), these are ignored
+TEXT = 2
+OUT_OF_RANGE = 3  # too long to be a count, the content is not looked at
+
+# no count will ever get near this, and int() of a whole message would be far slower
+MAX_LENGTH = 32
+
+# the same whole numbers int() accepts: surrounding whitespace, a sign, unicode digits and underscores
+_INTEGER = re.compile(r"\s*[+-]?\d+(?:_\d+)*\s*")
+# the rest of what float() accepts, checked only when the message is not a whole number
+_DIGITS = r"\d+(?:_\d+)*"
+_NUMERIC = re.compile(
+    rf"\s*[+-]?(?:(?:{_DIGITS}(?:\.(?:{_DIGITS})?)?|\.{_DIGITS})(?:e[+-]?{_DIGITS})?|inf(?:inity)?|nan)\s*",
+    re.IGNORECASE,
+)
+# 0x1f, 0o17 and 0b101 with the same rules as int(x, 0)
+_PREFIXED = re.compile(r"\s*[+-]?0(?:[xX](?:_?[0-9a-fA-F])+|[oO](?:_?[0-7])+|[bB](?:_?[01])+)\s*")
+# characters a math expression may consist of, anything else is text without parsing it
+_EXPRESSION = re.compile(r"[0-9a-fA-FxXoObB_+\-*/%().\s]+")
+
+_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+}
+_UNARY = {ast.UAdd: operator.pos, ast.USub: operator.neg}
+# bounds that keep every evaluation small, MAX_LENGTH already bounds the number of operations
+_MAX_EXPONENT = 64
+_MAX_VALUE = 10 ** 18
+
+
+def classify(content: str, expressions: bool = False) -> Tuple[int, Optional[int]]:
+    """Classify a counting message in one pass and return its kind and, for INTEGER, its value.
+
+    With `expressions` math like `2*3+1`, and integers in base 2, 8 and 16 count as well.
+    """
+    if len(content) > MAX_LENGTH:
+        return OUT_OF_RANGE, None
+    # plain digits are what almost every count looks like, they need no regex
+    if content.isdecimal():
+        return INTEGER, int(content)
+    if _INTEGER.fullmatch(content):
+        return INTEGER, int(content)
+    if expressions:
+        value = _evaluate(content)
+        if value is not None:
+            return INTEGER, value
+    if _NUMERIC.fullmatch(content):
+        return NUMERIC, None
+    return TEXT, None
+
+
+def _evaluate(content: str) -> Optional[int]:
+    if _PREFIXED.fullmatch(content):
+        return int(content, 0)
+    if not _EXPRESSION.fullmatch(content):
+        return None
+    try:
+        tree = ast.parse(content.strip(), mode="eval")
+        value = _evaluate_node(tree.body)
+    except (SyntaxError, ValueError, ZeroDivisionError, OverflowError):
+        return None
+    return value
+
+
+def _evaluate_node(node) -> int:
+    """Evaluate integer arithmetic, anything but integer literals and the operators above is refused."""
+    if isinstance(node, ast.Constant) and type(node.value) is int:
+        return node.value
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY:
+        return _UNARY[type(node.op)](_evaluate_node(node.operand))
+    if isinstance(node, ast.BinOp) and type(node.op) in _OPERATORS:
+        left = _evaluate_node(node.left)
+        right = _evaluate_node(node.right)
+        if isinstance(node.op, ast.Pow) and not 0 <= right <= _MAX_EXPONENT:
+            raise ValueError("exponent out of range")
+        value = _OPERATORS[type(node.op)](left, right)
+        if abs(value) > _MAX_VALUE:
+            raise ValueError("value out of range")
+        return value
+    raise ValueError("not an integer expression")
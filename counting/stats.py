@@ -0,0 +1,143 @@
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Dict, List, Tuple
+
+from redbot.core.config import Config
+
+# (guild_id, member_id)
+Key = Tuple[int, int]
+
+
+def new_member_stats() -> dict:
+    return {
+        "counts": 0,
+        "fails": 0,
+        # the highest number the member counted, and their longest run of counts without a fail
+        "pb": 0,
+        "streak": 0,
+        "best_streak": 0,
+        # [timestamp, why, correct_number] of the latest fails, oldest first
+        "recent_fails": [],
+    }
+
+
+class StatsStore:
+    """Counting stats of each member, kept in the member scope instead of the guild leaderboard.
+
+    Records of recently active members stay cached, up to ``capacity`` of them. Changed records
+    are kept until :meth:`save` wrote them, so evicting never loses a change. Counts and fails are
+    recorded without waiting for config, changes to a record that isn't loaded are applied once it
+    is, at the latest by the next save. A save of up to ``write_limit`` records writes them one by
+    one, a bigger one writes each guild's records in a single transaction.
+    """
+
+    def __init__(self, config: Config, capacity: int = 1000, recent_fails: int = 10, write_limit: int = 5):
+        self.config = config
+        self.capacity = capacity
+        self.recent_fails = recent_fails
+        self.write_limit = write_limit
+        self._cache: "OrderedDict[Key, dict]" = OrderedDict()
+        self._dirty: Dict[Key, dict] = {}
+        # changes to records that are not loaded yet, in the order they were made
+        self._pending: Dict[Key, List[Callable[[dict], None]]] = {}
+
+    async def get(self, guild_id: int, member_id: int) -> dict:
+        key = (guild_id, member_id)
+        record = self._dirty.get(key) or self._cache.get(key)
+        if record is None:
+            record = self._loaded(key, await self.config.member_from_ids(guild_id, member_id).all())
+        self._cache[key] = record
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.capacity:
+            self._cache.popitem(last=False)
+        return record
+
+    def _loaded(self, key: Key, record: dict) -> dict:
+        """Cache a record that was read from config, with the changes that waited for it."""
+        record["recent_fails"] = deque(record["recent_fails"], maxlen=self.recent_fails)
+        # another message may have loaded it while we were waiting for config
+        record = self._dirty.get(key) or self._cache.setdefault(key, record)
+        changes = self._pending.pop(key, None)
+        if changes:
+            for change in changes:
+                change(record)
+            self._dirty[key] = record
+        return record
+
+    async def _load_pending(self):
+        """Load the records that only have pending changes, which makes them dirty."""
+        if len(self._pending) <= self.write_limit:
+            for guild_id, member_id in list(self._pending):
+                await self.get(guild_id, member_id)
+            return
+        member_ids = {}
+        for guild_id, member_id in self._pending:
+            member_ids.setdefault(guild_id, []).append(member_id)
+        for guild_id, guild_member_ids in member_ids.items():
+            stored = await self.config._get_base_group(Config.MEMBER, str(guild_id)).all()
+            for member_id in guild_member_ids:
+                key = (guild_id, member_id)
+                if key in self._pending:
+                    self._loaded(key, {**new_member_stats(), **stored.get(str(member_id), {})})
+
+    def __len__(self):
+        return len(self._dirty) + len(self._pending)
+
+    def record_count(self, guild_id: int, member_id: int, number: int):
+        def count(record):
+            record["counts"] += 1
+            record["pb"] = max(record["pb"], number)
+            record["streak"] += 1
+            record["best_streak"] = max(record["best_streak"], record["streak"])
+
+        self._change((guild_id, member_id), count)
+
+    def record_fail(self, guild_id: int, member_id: int, why: int, correct_number: int):
+        fail = [int(time.time()), why, correct_number]
+
+        def record_fail(record):
+            record["fails"] += 1
+            record["streak"] = 0
+            # the deque drops the oldest fail once it is full
+            record["recent_fails"].append(fail)
+
+        self._change((guild_id, member_id), record_fail)
+
+    def _change(self, key: Key, change: Callable[[dict], None]):
+        record = self._dirty.get(key) or self._cache.get(key)
+        if record is None:
+            self._pending.setdefault(key, []).append(change)
+            return
+        change(record)
+        self._dirty[key] = record
+
+    def forget(self, member_id: int):
+        """Drop the cached and unsaved records of a member in every guild."""
+        for records in (self._cache, self._dirty, self._pending):
+            for key in [key for key in records if key[1] == member_id]:
+                del records[key]
+
+    async def save(self):
+        await self._load_pending()
+        dirty, self._dirty = self._dirty, {}
+        try:
+            if len(dirty) <= self.write_limit:
+                for (guild_id, member_id), record in list(dirty.items()):
+                    await self.config.member_from_ids(guild_id, member_id).set(
+                        {**record, "recent_fails": list(record["recent_fails"])}
+                    )
+                    del dirty[(guild_id, member_id)]
+            else:
+                records = {}
+                for (guild_id, member_id), record in dirty.items():
+                    records.setdefault(guild_id, {})[member_id] = {**record, "recent_fails": list(record["recent_fails"])}
+                for guild_id, guild_records in records.items():
+                    async with self.config._get_base_group(Config.MEMBER, str(guild_id)).all() as members:
+                        members.update((str(member_id), record) for member_id, record in guild_records.items())
+                    for member_id in guild_records:
+                        del dirty[(guild_id, member_id)]
+        except BaseException:
+            # changes made since then are already in the same record objects
+            for key, record in dirty.items():
+                self._dirty.setdefault(key, record)
+            raise
@@ -0,0 +1,117 @@
+import csv
+import datetime
+import io
+import itertools
+from typing import Iterator, List, Optional, Tuple
+
+import discord
+
+PAGE_SIZE = 25
+
+# (pretty time of last activity, username, user id, timestamp of last activity)
+Row = Tuple[str, str, int, int]
+
+_HEADER = (
+    "+-----------------------------------+-----------------------+\n"
+    "|     Time of last Activity         |        Username       |\n"
+    "+-----------------------------------+-----------------------+\n"
+)
+_FOOTER = "+-----------------------------------+-----------------------+"
+
+
+def render_pages(rows: Iterator[Row]) -> Iterator[str]:
+    """Lazily render the rows into code block tables of ``PAGE_SIZE`` users each."""
+    while True:
+        chunk = list(itertools.islice(rows, PAGE_SIZE))
+        if not chunk:
+            return
+        page = io.StringIO()
+        page.write("```\n")
+        page.write(_HEADER)
+        for pretty_time, name, _, _ in chunk:
+            page.write("|{:<35}|{:<23}|\n".format(pretty_time, name[:23]))
+        page.write(_FOOTER)
+        page.write("\n```")
+        yield page.getvalue()
+
+
+def render_csv(rows: Iterator[Row]) -> discord.File:
+    """Write all rows into a single CSV attachment."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["user_id", "username", "last_seen_utc", "inactive_seconds"])
+    now = int(datetime.datetime.now(datetime.timezone.utc).timestamp())
+    for _, name, user_id, seen in rows:
+        last_seen = datetime.datetime.fromtimestamp(seen, datetime.timezone.utc).isoformat()
+        writer.writerow([user_id, name, last_seen, now - seen])
+    return discord.File(io.BytesIO(buffer.getvalue().encode("utf-8")), filename="graveyard.csv")
+
+
+class GraveyardView(discord.ui.View):
+    """Paginator that only renders the next page when somebody asks for it."""
+
+    def __init__(self, author: discord.abc.User, pages: Iterator[str], timeout: float = 180):
+        super().__init__(timeout=timeout)
+        self.author = author
+        self.message: Optional[discord.Message] = None
+        self._pages = pages
+        self._rendered: List[str] = []
+        self._exhausted = False
+        self._current = 0
+
+    def _fetch(self, number: int) -> bool:
+        """Render pages until ``number`` is available, return False if there are not enough."""
+        while len(self._rendered) <= number and not self._exhausted:
+            page = next(self._pages, None)
+            if page is None:
+                self._exhausted = True
+            else:
+                self._rendered.append(page)
+        return number < len(self._rendered)
+
+    def first_page(self) -> Optional[str]:
+        if not self._fetch(0):
+            return None
+        self._update_buttons()
+        return self._content()
+
+    def _content(self) -> str:
+        return "{}\nPage {}".format(self._rendered[self._current], self._current + 1)
+
+    def _update_buttons(self):
+        self.previous_page.disabled = self._current == 0
+        # render one page ahead, so we know if there is a next one
+        self.next_page.disabled = not self._fetch(self._current + 1)
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id != self.author.id:
+            await interaction.response.send_message("This list is not yours.", ephemeral=True)
+            return False
+        return True
+
+    async def on_timeout(self):
+        if self.message is not None:
+            for item in self.children:
+                item.disabled = True
+            try:
+                await self.message.edit(view=self)
+            except discord.HTTPException:
+                pass
+
+    @discord.ui.button(label="Previous", style=discord.ButtonStyle.grey)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self._current = max(self._current - 1, 0)
+        self._update_buttons()
+        await interaction.response.edit_message(content=self._content(), view=self)
+
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.grey)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if self._fetch(self._current + 1):
+            self._current += 1
+        self._update_buttons()
+        await interaction.response.edit_message(content=self._content(), view=self)
+
+    @discord.ui.button(label="Close", style=discord.ButtonStyle.red)
+    async def close(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.stop()
+        await interaction.response.edit_message(view=None)
@@ -0,0 +1,144 @@
+import base64
+import bisect
+import sys
+from array import array
+from typing import Dict, Iterator, Optional, Tuple
+
+_PACK_VERSION = 1
+
+
+class LastSeenIndex:
+    """Last-seen timestamps of the members of one guild.
+
+    Member IDs and timestamps live in two parallel arrays sorted by member ID, which costs
+    12 bytes per member instead of a dict entry and two int objects. Members are also kept
+    in time buckets, so "inactive since" queries only visit the buckets below the cutoff and
+    return the members oldest first without sorting the whole guild.
+    """
+
+    BUCKET_SECONDS = 86400
+
+    def __init__(self, data: Optional[Dict[int, int]] = None):
+        self._ids = array("Q")
+        self._ts = array("I")
+        # bucket -> member IDs; entries are removed lazily, so a bucket may still list
+        # members that moved on to a newer bucket since
+        self._buckets: Dict[int, array] = {}
+        self._bucket_keys = []
+        self._stale = 0
+        if data:
+            for member_id in sorted(data):
+                self._ids.append(member_id)
+                self._ts.append(data[member_id])
+            self._rebuild_buckets()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, member_id):
+        return self._find(member_id) is not None
+
+    def _find(self, member_id: int) -> Optional[int]:
+        pos = bisect.bisect_left(self._ids, member_id)
+        if pos < len(self._ids) and self._ids[pos] == member_id:
+            return pos
+        return None
+
+    def get(self, member_id: int, default=None):
+        pos = self._find(member_id)
+        if pos is None:
+            return default
+        return self._ts[pos]
+
+    def items(self) -> Iterator[Tuple[int, int]]:
+        return zip(self._ids, self._ts)
+
+    def set(self, member_id: int, seen: int):
+        bucket = seen // self.BUCKET_SECONDS
+        pos = bisect.bisect_left(self._ids, member_id)
+        if pos < len(self._ids) and self._ids[pos] == member_id:
+            previous_bucket = self._ts[pos] // self.BUCKET_SECONDS
+            self._ts[pos] = seen
+            if previous_bucket == bucket:
+                return
+            self._stale += 1
+        else:
+            self._ids.insert(pos, member_id)
+            self._ts.insert(pos, seen)
+        members = self._buckets.get(bucket)
+        if members is None:
+            members = self._buckets[bucket] = array("Q")
+            bisect.insort(self._bucket_keys, bucket)
+        members.append(member_id)
+        if self._stale > len(self._ids):
+            self._rebuild_buckets()
+
+    def pop(self, member_id: int, default=None):
+        pos = self._find(member_id)
+        if pos is None:
+            return default
+        seen = self._ts[pos]
+        del self._ids[pos]
+        del self._ts[pos]
+        self._stale += 1
+        return seen
+
+    def _rebuild_buckets(self):
+        size = self.BUCKET_SECONDS
+        buckets = {}
+        for member_id, seen in zip(self._ids, self._ts):
+            bucket = buckets.get(seen // size)
+            if bucket is None:
+                bucket = buckets[seen // size] = array("Q")
+            bucket.append(member_id)
+        self._buckets = buckets
+        self._bucket_keys = sorted(buckets)
+        self._stale = 0
+
+    def inactive_since(self, cutoff: int) -> Iterator[Tuple[int, int]]:
+        """Yield ``(seen, member_id)`` for every member not seen after ``cutoff``, oldest first.
+
+        Members are sorted bucket by bucket while iterating, so reading the first page of a
+        large result only costs the buckets that page comes from.
+        """
+        size = self.BUCKET_SECONDS
+        last_bucket = cutoff // size
+        end = bisect.bisect_right(self._bucket_keys, last_bucket)
+        for bucket in self._bucket_keys[:end]:
+            entries = {}
+            for member_id in self._buckets.get(bucket, ()):
+                seen = self.get(member_id)
+                # skip entries left behind by members that moved to another bucket
+                if seen is not None and seen // size == bucket:
+                    entries[member_id] = seen
+            entries = sorted((seen, member_id) for member_id, seen in entries.items())
+            if bucket == last_bucket:
+                entries = entries[: bisect.bisect_right(entries, (cutoff, float("inf")))]
+            yield from entries
+
+    def pack(self) -> str:
+        """Serialize the index into a compact base64 string for config storage."""
+        ids = array("Q", self._ids)
+        ts = array("I", self._ts)
+        if sys.byteorder == "big":
+            ids.byteswap()
+            ts.byteswap()
+        return base64.b64encode(bytes([_PACK_VERSION]) + ids.tobytes() + ts.tobytes()).decode("ascii")
+
+    @classmethod
+    def unpack(cls, packed: Optional[str]) -> Dict[int, int]:
+        """Turn a string made by :meth:`pack` back into a ``member_id -> seen`` mapping."""
+        if not packed:
+            return {}
+        raw = base64.b64decode(packed)
+        if raw[0] != _PACK_VERSION:
+            raise ValueError("Unknown packed index version {}".format(raw[0]))
+        count = (len(raw) - 1) // 12
+        ids = array("Q")
+        ts = array("I")
+        ids.frombytes(raw[1 : 1 + count * 8])
+        ts.frombytes(raw[1 + count * 8 :])
+        if sys.byteorder == "big":
+            ids.byteswap()
+            ts.byteswap()
+        return dict(zip(ids, ts))
@@ -0,0 +1,78 @@
+import struct
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+# guild ID, member ID, last seen timestamp; a timestamp of 0 marks a member whose data got deleted
+_RECORD = struct.Struct("<QQI")
+
+
+class ActivityJournal:
+    """Append-only log of recorded activity that has not been flushed to config yet.
+
+    Records go to numbered segment files through a buffered writer. A flush calls
+    :meth:`rotate` when it takes over the pending activity and :meth:`discard_before` once
+    that activity is in config, so the journal only ever holds what a crash would lose.
+    """
+
+    def __init__(self, path: Path):
+        self._path = path
+        self._file: Optional[BinaryIO] = None
+        self._segment = 0
+
+    def _segments(self) -> List[Tuple[int, Path]]:
+        if not self._path.exists():
+            return []
+        return sorted((int(segment.stem), segment) for segment in self._path.glob("*.journal"))
+
+    def replay(self) -> Dict[int, Dict[int, int]]:
+        """Read all segments and return the newest timestamp of every journaled member by guild."""
+        data = {}
+        for _, segment in self._segments():
+            raw = segment.read_bytes()
+            # a crash can leave a partly written record at the end of a segment
+            raw = raw[: len(raw) - len(raw) % _RECORD.size]
+            for guild_id, member_id, seen in _RECORD.iter_unpack(raw):
+                members = data.setdefault(guild_id, {})
+                if not seen:
+                    members.pop(member_id, None)
+                elif members.get(member_id, 0) < seen:
+                    members[member_id] = seen
+        return data
+
+    def open(self):
+        self._path.mkdir(parents=True, exist_ok=True)
+        segments = self._segments()
+        self._segment = segments[-1][0] + 1 if segments else 0
+        self._file = open(self._path / "{}.journal".format(self._segment), "ab")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def append(self, guild_id: int, member_id: int, seen: int):
+        if self._file is not None:
+            self._file.write(_RECORD.pack(guild_id, member_id, seen))
+
+    def forget(self, guild_id: int, member_id: int):
+        """Record that a member's data got deleted, so a replay does not bring it back."""
+        self.append(guild_id, member_id, 0)
+
+    def sync(self):
+        """Hand the buffered records to the OS, after this they survive a crash of the bot."""
+        if self._file is not None:
+            self._file.flush()
+
+    def rotate(self) -> int:
+        """Start a new segment and return its number, every older segment can be discarded after a flush."""
+        if self._file is None:
+            return self._segment
+        self._file.close()
+        self._segment += 1
+        self._file = open(self._path / "{}.journal".format(self._segment), "ab")
+        return self._segment
+
+    def discard_before(self, segment: int):
+        for number, path in self._segments():
+            if number < segment:
+                path.unlink()
@@ -0,0 +1,133 @@
+# Seen and Counting each ship this module, as cogs are installed on their own.
+# The two copies are kept identical, tests/test_metrics.py fails when they drift apart.
+import functools
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List
+
+# upper bounds of the timing histogram buckets in seconds, the last bucket takes everything above
+BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+class Histogram:
+    __slots__ = ("buckets", "count", "sum")
+
+    def __init__(self):
+        self.buckets: List[int] = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        self.buckets[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket the quantile falls into."""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    """Counters, gauges and timing histograms kept in plain dicts.
+
+    Recording is a dict lookup and an addition, so the metrics stay on in production.
+    Gauges are callbacks that are only read when the metrics are rendered.
+    """
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self.counters: Dict[str, int] = {}
+        # counters the cog already keeps itself, read like gauges
+        self.counter_reads: Dict[str, Callable[[], int]] = {}
+        self.histograms: Dict[str, Histogram] = {}
+        self.gauges: Dict[str, Callable[[], float]] = {}
+
+    def inc(self, name: str, amount: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name: str, seconds: float):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.observe(seconds)
+
+    def gauge(self, name: str, read: Callable[[], float]):
+        self.gauges[name] = read
+
+    def counter(self, name: str, read: Callable[[], int]):
+        self.counter_reads[name] = read
+
+    def _counters(self) -> Dict[str, int]:
+        counters = dict(self.counters)
+        counters.update((name, read()) for name, read in self.counter_reads.items())
+        return counters
+
+    def count_config_calls(self, config):
+        """Count the calls and time of every read and write the config's driver does."""
+        # Config has no public accessor for its driver, and every read and write goes through it
+        driver = config._driver
+        for method in ("get", "set", "clear", "inc"):
+            original = getattr(driver, method, None)
+            if original is not None:
+                setattr(driver, method, self._timed_call(f"config_{method}", original))
+
+    def _timed_call(self, name: str, call):
+        @functools.wraps(call)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await call(*args, **kwargs)
+            finally:
+                self.observe(name, time.perf_counter() - start)
+        return wrapper
+
+    def summary(self) -> List[str]:
+        lines = [f"{name}: {value}" for name, value in sorted(self._counters().items())]
+        lines += [f"{name}: {read()}" for name, read in sorted(self.gauges.items())]
+        for name, histogram in sorted(self.histograms.items()):
+            if histogram.count:
+                lines.append(
+                    "{}: {} calls, mean {:.3f} ms, p50 <= {} ms, p99 <= {} ms".format(
+                        name, histogram.count, histogram.sum / histogram.count * 1000,
+                        histogram.quantile(0.5) * 1000, histogram.quantile(0.99) * 1000,
+                    )
+                )
+        return lines
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        lines = []
+        for name, value in sorted(self._counters().items()):
+            lines += [f"# TYPE {self.prefix}_{name}_total counter", f"{self.prefix}_{name}_total {value}"]
+        for name, read in sorted(self.gauges.items()):
+            lines += [f"# TYPE {self.prefix}_{name} gauge", f"{self.prefix}_{name} {read()}"]
+        for name, histogram in sorted(self.histograms.items()):
+            metric = f"{self.prefix}_{name}_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, count in zip(BUCKETS, histogram.buckets):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{le="+Inf"}} {histogram.count}')
+            lines += [f"{metric}_sum {histogram.sum}", f"{metric}_count {histogram.count}"]
+        return "\n".join(lines) + "\n"
+
+
+def timed(name: str):
+    """Time an async method in the histogram ``name`` of its cog's ``_metrics``."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(self, *args, **kwargs)
+            finally:
+                self._metrics.observe(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
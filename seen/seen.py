@@ -1,14 +1,33 @@
 import asyncio
 import contextlib
 import datetime
-from typing import Optional, Union, Literal
+import logging
+import random
+from typing import Iterator, Optional, Union, Literal
 
 import discord
 import time
 
 from redbot.core import Config, commands
+from redbot.core.data_manager import cog_data_path
+from redbot.core.utils.chat_formatting import box, pagify
 
-_SCHEMA_VERSION = 2
+from . import graveyard
+from .index import LastSeenIndex
+from .journal import ActivityJournal
+from .metrics import Metrics, timed
+
+log = logging.getLogger("red.rustypredator.seen")
+
+_SCHEMA_VERSION = 4
+_MIGRATION_CHUNK = 1000
+# guilds migrated between two checkpoints, the steps are idempotent so a resume may redo some
+_MIGRATION_CHECKPOINT_EVERY = 100
+# member entries of a guild after which it is always compacted, they are rewritten by every bulk flush of the guild
+_MAX_DELTAS = 1000
+_EVENT_TYPES = ("message", "edit", "typing", "reaction", "voice")
+# message based events keep their full accuracy, only the noisy streams can be sampled
+_SAMPLED_EVENT_TYPES = ("typing", "reaction")
 
 
 class Seen(commands.Cog):
@@ -16,84 +35,238 @@ class Seen(commands.Cog):
 
     async def red_delete_data_for_user(self, *, requester: Literal["discord", "owner", "user", "user_strict"], user_id: int):
         if requester in ["discord", "owner"]:
-            data = await self.config.all_members()
-            for guild_id, members in data.items():
-                if user_id in members:
-                    await self.config.member_from_ids(guild_id, user_id).clear()
+            # holding the flush lock keeps the flush from writing the user back while we delete
+            # the migration writes the reverse index, it has to be complete before we read it
+            await self._migrated.wait()
+            async with self._flush_lock:
+                user_data = await self.config.user_from_id(user_id).all()
+                guild_ids = set(user_data["guilds"]).union(int(guild_id) for guild_id in user_data["guild_map"])
+                for guild_id, member_data in self._cache.items():
+                    if member_data.pop(user_id, None) is not None:
+                        guild_ids.add(guild_id)
+                for guild_id in guild_ids:
+                    self._journal.forget(guild_id, user_id)
+                    index = await self._get_index(guild_id)
+                    index.pop(user_id, None)
+                    self._new_members.get(guild_id, set()).discard(user_id)
+                    # rewrite the guild's packed blob without the user, this drops its member entry too
+                    await self._compact(guild_id, force=True)
+                await self.config.user_from_id(user_id).clear()
 
     def __init__(self, bot):
         self.bot = bot
         self.config = Config.get_conf(self, 2784481001, force_registration=True)
 
-        default_global = dict(schema_version=1)
+        # event filters are kept in the global scope, keyed by guild ID, so loading them on startup
+        # doesn't pull every guild's packed index along
+        default_global = dict(
+            schema_version=1,
+            migration_checkpoint={"version": None, "guild_id": 0},
+            flush_interval=60,
+            flush_batch_size=5,
+            resolution=60,
+            event_filters={},
+            merge_safe=False,
+        )
+        default_guild = dict(packed=None)
         default_member = dict(seen=None)
+        # reverse index of the guilds a user is tracked in, used for data deletion requests. Small flushes
+        # and merge-safe mode add to the dict instead, one key per user and guild, so they never have to
+        # read the user scope and every process only writes the keys of its own guilds
+        default_user = dict(guilds=[], guild_map={})
 
         self.config.register_global(**default_global)
+        self.config.register_guild(**default_guild)
         self.config.register_member(**default_member)
+        self.config.register_user(**default_user)
 
         self._cache = {}
+        self._flushing = {}
+        self._index = {}
+        self._index_loading = {}
+        self._deltas = {}
+        # members of loaded guilds that are not in the user reverse index yet
+        self._new_members = {}
+        self._flush_interval = default_global["flush_interval"]
+        self._flush_batch_size = default_global["flush_batch_size"]
+        self._resolution = default_global["resolution"]
+        self._merge_safe = default_global["merge_safe"]
+        self._tick = None
+        self._events_seen = 0
+        self._events_dropped = 0
+        self._events_sampled_out = 0
+        # (guild_id, event) pairs that are not counted as activity, and sampling rates of the others
+        self._disabled_events = set()
+        self._sampling = {}
+        self._flush_lock = asyncio.Lock()
+        self._last_flush = None
+        self._last_flush_at = None
+        self._journal = ActivityJournal(self._journal_path())
         self._task = self.bot.loop.create_task(self._save_to_config())
+        self._journal_task = self.bot.loop.create_task(self._sync_journal())
+        self._migration_task = None
+        self._migration_status = None
+        self._migrated = asyncio.Event()
+        self._metrics = Metrics("red_seen")
+        self._metrics.count_config_calls(self.config)
+        self._metrics.counter("events_seen", lambda: self._events_seen)
+        self._metrics.counter("events_dropped", lambda: self._events_dropped)
+        self._metrics.counter("events_sampled_out", lambda: self._events_sampled_out)
+        self._metrics.gauge("pending_members", lambda: sum(len(members) for members in self._cache.values()))
+        self._metrics.gauge("indexed_guilds", lambda: len(self._index))
+        self._metrics.gauge("indexed_members", lambda: sum(len(index) for index in self._index.values()))
+        self._metrics.gauge(
+            "flush_lag_seconds", lambda: round(time.time() - self._last_flush_at) if self._last_flush_at else -1
+        )
 
     async def initialize(self):
-        asyncio.ensure_future(
+        self._flush_interval = await self.config.flush_interval()
+        self._flush_batch_size = await self.config.flush_batch_size()
+        self._resolution = await self.config.resolution()
+        self._merge_safe = await self.config.merge_safe()
+        for guild_id, event_filter in (await self.config.event_filters()).items():
+            self._set_event_filter(int(guild_id), event_filter["events"], event_filter["sampling"])
+        # bring back the activity that didn't make it into config before the last shutdown or crash
+        for guild_id, member_data in self._journal.replay().items():
+            cached = self._cache.setdefault(guild_id, {})
+            for member_id, seen in member_data.items():
+                if cached.get(member_id, 0) < seen:
+                    cached[member_id] = seen
+        self._journal.open()
+        self._migration_task = self.bot.loop.create_task(
             self._migrate_config(from_version=await self.config.schema_version(), to_version=_SCHEMA_VERSION)
         )
 
     async def _migrate_config(self, from_version: int, to_version: int):
-        if from_version == to_version:
+        """Bring the stored data from ``from_version`` up to ``to_version``, one guild at a time.
+
+        Every step handles a single guild per iteration and works through its members in chunks
+        of ``_MIGRATION_CHUNK``, yielding to the event loop in between. The guilds the bot is in and
+        those with a packed blob are visited first, and every ``_MIGRATION_CHECKPOINT_EVERY`` guilds
+        the last finished one is checkpointed in the global scope, so an interrupted migration
+        resumes close to where it stopped. Guilds the bot has left that only have member entries
+        can't be listed without reading the member scope, so they are migrated last, when the member
+        scope only holds their entries and the deltas of the others. Reads of the index and flushes
+        wait until the migration is done.
+        """
+        steps = {2: self._migrate_guild_to_v2, 3: self._migrate_guild_to_v3, 4: self._migrate_guild_to_v4}
+        try:
+            if from_version >= to_version:
+                return
+            await self.bot.wait_until_red_ready()
+            # in ID order, so the checkpoint only has to remember the last one
+            guild_ids = sorted(await self._known_guild_ids())
+            for version in range(from_version + 1, to_version + 1):
+                checkpoint = await self.config.migration_checkpoint()
+                if checkpoint["version"] != version:
+                    checkpoint = {"version": version, "guild_id": 0}
+                remaining = [guild_id for guild_id in guild_ids if guild_id > checkpoint["guild_id"]]
+                log.info("Migrating Seen data to schema version %d, %d guilds to go.", version, len(remaining))
+                for done, guild_id in enumerate(remaining, 1):
+                    await steps[version](guild_id)
+                    self._migration_status = "schema version {}: {}/{} guilds".format(version, done, len(remaining))
+                    if done % _MIGRATION_CHECKPOINT_EVERY == 0:
+                        checkpoint["guild_id"] = guild_id
+                        await self.config.migration_checkpoint.set(checkpoint)
+                        log.info("Migrating Seen data to schema version %d: %d/%d guilds done.", version, done, len(remaining))
+                if version < to_version:
+                    await self.config.schema_version.set(version)
+            # the steps can be redone, so this pass takes the left guilds through all of them and is
+            # simply repeated if it gets interrupted
+            stray_guild_ids = sorted(await self._member_guild_ids() - set(guild_ids))
+            if stray_guild_ids:
+                log.info("Migrating Seen data of %d guilds the bot has left.", len(stray_guild_ids))
+            for done, guild_id in enumerate(stray_guild_ids, 1):
+                for version in sorted(steps):
+                    await steps[version](guild_id)
+                self._migration_status = "guilds the bot has left: {}/{} guilds".format(done, len(stray_guild_ids))
+            await self.config.schema_version.set(to_version)
+            log.info("Seen data is now at schema version %d.", to_version)
+        except Exception:
+            log.exception("Migrating Seen data failed, it will be resumed on the next load.")
+        finally:
+            # anything indexed before the migration finished is stale now
+            self._index.clear()
+            self._deltas.clear()
+            self._new_members.clear()
+            self._migration_status = None
+            self._migrated.set()
+
+    async def _known_guild_ids(self) -> set:
+        """The guilds the bot is in, and those with a packed blob, including ones the bot has left or that are unavailable."""
+        guild_ids = {guild.id for guild in self.bot.guilds}
+        guild_ids.update(int(guild_id) for guild_id in await self.config._get_base_group(self.config.GUILD).all())
+        return guild_ids
+
+    async def _member_guild_ids(self) -> set:
+        return {int(guild_id) for guild_id in await self.config._get_base_group(self.config.MEMBER).all()}
+
+    @staticmethod
+    async def _chunked(items):
+        """Iterate over ``items`` and give the event loop a turn after every chunk."""
+        for position, item in enumerate(items, 1):
+            yield item
+            if position % _MIGRATION_CHUNK == 0:
+                await asyncio.sleep(0)
+
+    async def _migrate_guild_to_v2(self, guild_id: int):
+        # collapse whatever was stored per member into a single "seen" value, keeping the newest
+        group = self.config._get_base_group(self.config.MEMBER, str(guild_id))
+        guild_data = await group.all()
+        if not guild_data:
+            return
+        users_data = {}
+        async for user_id, user_data in self._chunked(list(guild_data.items())):
+            values = [v for v in user_data.values() if isinstance(v, int) and v]
+            users_data[user_id] = {"seen": max(values) if values else None}
+        await group.set(users_data)
+
+    async def _migrate_guild_to_v3(self, guild_id: int):
+        # pack the guild's member entries into a single compact blob
+        group = self.config._get_base_group(self.config.MEMBER, str(guild_id))
+        guild_data = await group.all()
+        if not guild_data:
             return
-        elif from_version < to_version:
-            all_guild_data = await self.config.all_members()
-            users_data = {}
-            for guild_id, guild_data in all_guild_data.items():
-                for user_id, user_data in guild_data.items():
-                    for _, v in user_data.items():
-                        if not v:
-                            v = None
-                        if user_id not in users_data:
-                            users_data[guild_id][user_id] = {"seen": v}
-                        else:
-                            if (v and not users_data[guild_id][user_id]["seen"]) or (
-                                v
-                                and users_data[guild_id][user_id]["seen"]
-                                and v > users_data[guild_id][user_id]["seen"]
-                            ):
-                                users_data[guild_id][user_id] = {"seen": v}
-
-            group = self.config._get_base_group(self.config.MEMBER)  # Bulk update to new scope
-            async with group.all() as new_data:
-                for guild_id, member_data in users_data.items():
-                    new_data[guild_id] = member_data
-
-            # new schema is now in place
-            await self.config.schema_version.set(_SCHEMA_VERSION)
-
-            # migration done, now let's delete all the old stuff
-            await self.config.clear_all_members()
+        data = LastSeenIndex.unpack(await self.config.guild_from_id(guild_id).packed())
+        async for user_id, user_data in self._chunked(list(guild_data.items())):
+            seen = user_data.get("seen")
+            if seen and data.get(int(user_id), 0) < seen:
+                data[int(user_id)] = seen
+        await self.config.guild_from_id(guild_id).packed.set(LastSeenIndex(data).pack())
+        await group.clear()
+
+    async def _migrate_guild_to_v4(self, guild_id: int):
+        # add the guild to the user -> guilds reverse index of every member it tracks
+        user_ids = set(LastSeenIndex.unpack(await self.config.guild_from_id(guild_id).packed()))
+        group = self.config._get_base_group(self.config.MEMBER, str(guild_id))
+        user_ids.update(int(user_id) for user_id in await group.all())
+        if user_ids:
+            await self._add_to_reverse_index({guild_id: user_ids})
+
+    async def _add_to_reverse_index(self, guild_members):
+        """Add guilds to the reverse index of their members in a single write of the user scope.
+
+        ``guild_members`` maps guild IDs to the IDs of the members to add it for.
+        """
+        async with self.config._get_base_group(self.config.USER).all() as users:
+            for guild_id, user_ids in guild_members.items():
+                async for user_id in self._chunked(user_ids):
+                    guild_ids = users.setdefault(str(user_id), {}).setdefault("guilds", [])
+                    if guild_id not in guild_ids:
+                        guild_ids.append(guild_id)
 
     @commands.guild_only()
     @commands.command(name="seen")
     @commands.bot_has_permissions(embed_links=True)
     async def _seen(self, ctx, *, author: discord.Member):
         """Shows last time a user was seen in chat."""
-        member_seen_config = await self.config.member(author).seen()
-        member_seen_cache = self._cache.get(author.guild.id, {}).get(author.id, None)
+        index = await self._get_index(author.guild.id)
+        member_seen = index.get(author.id)
 
-        if not member_seen_cache and not member_seen_config:
+        if not member_seen:
             embed = discord.Embed(colour=discord.Color.red(), title="I haven't seen that user yet.")
             return await ctx.send(embed=embed)
 
-        if not member_seen_cache:
-            member_seen = member_seen_config
-        elif not member_seen_config:
-            member_seen = member_seen_cache
-        elif member_seen_cache > member_seen_config:
-            member_seen = member_seen_cache
-        elif member_seen_config > member_seen_cache:
-            member_seen = member_seen_config
-        else:
-            member_seen = member_seen_cache or member_seen_config
-
         now = int(time.time())
         time_elapsed = int(now - member_seen)
         output = self._dynamic_time(time_elapsed)
@@ -121,8 +294,12 @@ class Seen(commands.Cog):
 
     @commands.guild_only()
     @commands.command(name="graveyard")
-    async def _graveyard(self, ctx, limit: str = None):
-        """Shows a list of users that have not been seen for more than <limit><unit>."""
+    async def _graveyard(self, ctx, limit: str = None, export: str = None):
+        """Shows a list of users that have not been seen for more than <limit><unit>.
+
+        The list is sorted by the time of last activity, oldest first.
+        Add `csv` after the limit to get the whole list as a single CSV file instead of pages.
+        """
         author = ctx.message.author
         guild = author.guild
         # check parameters:
@@ -133,10 +310,10 @@ class Seen(commands.Cog):
         limit = int(limit[:-1])
         if unit not in ['s', 'm', 'h', 'd']:
             return await ctx.send("Please set a valid limit. (Examples: 15m = 15 Minutes. Available Units: s = seconds, m = minutes, h = hours, d = days)")
-        # variables:
-        embed_title = "A list of users that have not been active for more than " + str(limit) + str(unit)
-        # get all users from cache:
-        users_config = await self.config.all_members(ctx.guild)
+        if export is not None and export.lower() != "csv":
+            return await ctx.send("Unknown export format. Use `csv` or leave it out to get pages.")
+        # get all users from the index:
+        index = await self._get_index(guild.id)
         # calculate low timestamp:
         now = int(time.time())
         seconds = 0
@@ -149,20 +326,24 @@ class Seen(commands.Cog):
         if unit == "d":
             seconds = (limit * 60 * 60 * 24)
         low_timestamp = (now - int(seconds))
-        # loop members, and calculate if they have been inactive for more than "limit"
-        userlist = {}
-        for user_id in users_config:
+        rows = self._graveyard_rows(guild, index.inactive_since(low_timestamp), now)
+        if export is not None:
+            return await ctx.send(
+                "Users that have not been active for more than {}{}:".format(limit, unit), file=graveyard.render_csv(rows)
+            )
+        view = graveyard.GraveyardView(author, graveyard.render_pages(rows))
+        content = view.first_page()
+        if content is None:
+            return await ctx.send("There are no users that have been inactive for more than {}{}.".format(limit, unit))
+        view.message = await ctx.send(content, view=view)
+
+    def _graveyard_rows(self, guild: discord.Guild, inactive, now: int) -> Iterator[graveyard.Row]:
+        for member_seen, user_id in inactive:
             # check user
-            user = (ctx.message.guild.get_member(user_id))
+            user = guild.get_member(user_id)
             if user is None:
                 # user is broken or not in guild anymore, skip.
                 continue
-            #get timestamp:
-            member_seen = await self.config.member(user).seen()
-            # check against limit:
-            if member_seen > low_timestamp:
-                # User has been active later than the limit set, skip.
-                continue
             # create pretty timestamp
             time_elapsed = int(now - member_seen)
             output = self._dynamic_time(time_elapsed)
@@ -173,30 +354,167 @@ class Seen(commands.Cog):
                 pretty_timestamp += "D: {} ".format(str(output[0]).ljust(4))
                 pretty_timestamp += "H: {} ".format(str(output[1]).ljust(2))
                 pretty_timestamp += "M: {} ago".format(str(output[2]).ljust(2))
-            # put everything in an dict, and append it to the list:
-            user_array = {"user_id": user_id, "pretty_time": pretty_timestamp}
-            userlist[member_seen] = user_array
-        output_header = "+-----------------------------------+-----------------------+\n|     Time of last Activity         |        Username       |\n+-----------------------------------+-----------------------+\n"
-        output_footer = "+-----------------------------------+-----------------------+"
-        output = "```\n" + output_header
-        for timestamp in userlist:
-            data = userlist[timestamp]
-            user = ctx.message.guild.get_member(data["user_id"])
-            row = "|" + (str(data["pretty_time"])).ljust(35) + "|" + str(user.name).ljust(23) + "|\n"
-            if (len(output) + (len(row)+len(output_footer))) >= 1024:
-                #finish this one first, and then start a new one.
-                output = output + output_footer + "\n```"
-                await ctx.send(output)
-                #start a new output:
-                output = "```\n" + output_header
-            #add to current output:
-            output = output + row
-        # finish output
-        output = output + output_footer + "\n```"
-        # build the embed:
-        # embed = discord.Embed(colour=discord.Color.green(), title=embed_title)
-        # embed.add_field(name='userlist', value=output)
-        await ctx.send(output)
+            yield pretty_timestamp, user.name, user_id, member_seen
+
+    @commands.group(name="seenset")
+    async def _seenset(self, ctx):
+        """Configure how Seen tracks and persists activity."""
+
+    @commands.guild_only()
+    @commands.admin_or_permissions(manage_guild=True)
+    @_seenset.command(name="events")
+    async def _seenset_events(self, ctx, *events: str):
+        """Set which events count as activity in this server.
+
+        Available events: message, edit, typing, reaction, voice.
+        Without events the current selection is shown.
+        """
+        guild = ctx.guild
+        if not events:
+            enabled = [event for event in _EVENT_TYPES if (guild.id, event) not in self._disabled_events]
+            return await ctx.send("Events counted as activity: {}.".format(", ".join(enabled) or "none"))
+        events = [event.lower() for event in events]
+        unknown = [event for event in events if event not in _EVENT_TYPES]
+        if unknown:
+            return await ctx.send(
+                "Unknown events: {}. Available events: {}.".format(", ".join(unknown), ", ".join(_EVENT_TYPES))
+            )
+        enabled = [event for event in _EVENT_TYPES if event in events]
+        async with self.config.event_filters() as event_filters:
+            event_filter = event_filters.setdefault(str(guild.id), {"events": list(_EVENT_TYPES), "sampling": {}})
+            event_filter["events"] = enabled
+            self._set_event_filter(guild.id, enabled, event_filter["sampling"])
+        await ctx.send("Events counted as activity: {}.".format(", ".join(enabled)))
+
+    @commands.guild_only()
+    @commands.admin_or_permissions(manage_guild=True)
+    @_seenset.command(name="sample")
+    async def _seenset_sample(self, ctx, event: str, percent: int):
+        """Only record <percent> of the events of a noisy type in this server.
+
+        Sampling is available for typing and reaction events. Use 100 to record all of them again.
+        """
+        guild = ctx.guild
+        event = event.lower()
+        if event not in _SAMPLED_EVENT_TYPES:
+            return await ctx.send("Only these events can be sampled: {}.".format(", ".join(_SAMPLED_EVENT_TYPES)))
+        if not 1 <= percent <= 100:
+            return await ctx.send("The percentage has to be between 1 and 100.")
+        async with self.config.event_filters() as event_filters:
+            event_filter = event_filters.setdefault(str(guild.id), {"events": list(_EVENT_TYPES), "sampling": {}})
+            if percent == 100:
+                event_filter["sampling"].pop(event, None)
+            else:
+                event_filter["sampling"][event] = percent
+            self._set_event_filter(guild.id, event_filter["events"], event_filter["sampling"])
+        await ctx.send("Recording {}% of the {} events.".format(percent, event))
+
+    def _set_event_filter(self, guild_id: int, events, sampling):
+        for event in _EVENT_TYPES:
+            key = (guild_id, event)
+            if event in events:
+                self._disabled_events.discard(key)
+            else:
+                self._disabled_events.add(key)
+            if event in sampling:
+                self._sampling[key] = sampling[event] / 100
+            else:
+                self._sampling.pop(key, None)
+
+    @commands.is_owner()
+    @_seenset.command(name="flushinterval")
+    async def _seenset_flushinterval(self, ctx, seconds: int):
+        """Set how many seconds pass between two flushes of recorded activity."""
+        if seconds < 5:
+            return await ctx.send("The flush interval has to be at least 5 seconds.")
+        await self.config.flush_interval.set(seconds)
+        self._flush_interval = seconds
+        await ctx.send("Activity will now be flushed every {} seconds.".format(seconds))
+
+    @commands.is_owner()
+    @_seenset.command(name="batchsize")
+    async def _seenset_batchsize(self, ctx, size: int):
+        """Set how many dirty members a flush writes one by one.
+
+        Flushes with more pending members than this write the members of each guild in a single block.
+        """
+        if size < 1:
+            return await ctx.send("The batch size has to be at least 1.")
+        await self.config.flush_batch_size.set(size)
+        self._flush_batch_size = size
+        await ctx.send("Flush batch size set to {}.".format(size))
+
+    @commands.is_owner()
+    @_seenset.command(name="resolution")
+    async def _seenset_resolution(self, ctx, seconds: int):
+        """Set how many seconds of activity are merged into one recorded timestamp.
+
+        Events of a member that was already recorded less than this many seconds ago are dropped.
+        Use 0 to record every event.
+        """
+        if seconds < 0:
+            return await ctx.send("The resolution can't be negative.")
+        await self.config.resolution.set(seconds)
+        self._resolution = seconds
+        await ctx.send("Activity is now recorded with a resolution of {} seconds.".format(seconds))
+
+    @commands.is_owner()
+    @_seenset.command(name="mergesafe")
+    async def _seenset_mergesafe(self, ctx, enabled: bool):
+        """Make flushes safe for several bot processes that share one config backend.
+
+        Every member is written on its own and only if the stored timestamp is older, and only the
+        process whose shards a guild is on rewrites its packed data. Flushes get slower, so only use
+        this when the bot is sharded across processes.
+        """
+        async with self._flush_lock:
+            await self.config.merge_safe.set(enabled)
+            self._merge_safe = enabled
+        await ctx.send("Merge-safe flushing is now {}.".format("enabled" if enabled else "disabled"))
+
+    @commands.is_owner()
+    @_seenset.command(name="migration")
+    async def _seenset_migration(self, ctx):
+        """Show the progress of a running data migration."""
+        if self._migration_status is None:
+            return await ctx.send("No migration is running, the data is at schema version {}.".format(await self.config.schema_version()))
+        await ctx.send("Migrating to {}.".format(self._migration_status))
+
+    @commands.is_owner()
+    @_seenset.command(name="flushstats")
+    async def _seenset_flushstats(self, ctx):
+        """Show the metrics of the last flush and of the recorded events."""
+        pending = sum(len(members) for members in self._cache.values())
+        events = "{} events seen, {} dropped as redundant, {} skipped by sampling.".format(
+            self._events_seen, self._events_dropped, self._events_sampled_out
+        )
+        if self._last_flush is None:
+            return await ctx.send("Nothing has been flushed yet. {} members are pending. {}".format(pending, events))
+        stats = self._last_flush
+        await ctx.send(
+            "Last flush: {keys} keys in {guilds} guilds, {bytes} bytes serialized, {ms:.1f} ms. "
+            "{pending} members are pending. {events}".format(
+                keys=stats["keys"],
+                guilds=stats["guilds"],
+                bytes=stats["bytes"],
+                ms=stats["seconds"] * 1000,
+                pending=pending,
+                events=events,
+            )
+        )
+
+    @commands.is_owner()
+    @_seenset.command(name="cogstats")
+    async def _seenset_cogstats(self, ctx, export: bool = False):
+        """Show the runtime metrics of Seen, or write them to a file in Prometheus format."""
+        if export:
+            path = cog_data_path(self) / "metrics.prom"
+            tmp = path.with_suffix(".tmp")
+            tmp.write_text(self._metrics.render(), encoding="utf-8")
+            tmp.replace(path)
+            return await ctx.send("Wrote the metrics to `{}`.".format(path))
+        for page in pagify("\n".join(self._metrics.summary())):
+            await ctx.send(box(page))
 
     @staticmethod
     def _dynamic_time(time_elapsed):
@@ -206,74 +524,315 @@ class Seen(commands.Cog):
         return d, h, m
 
     @commands.Cog.listener()
+    @timed("listener_voice_state_update")
     async def on_voice_state_update(self, user: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
-        if getattr(user, "guild", None):
-            if user.guild.id not in self._cache:
-                self._cache[user.guild.id] = {}
-            self._cache[user.guild.id][user.id] = int(time.time())
+        guild = getattr(user, "guild", None)
+        if guild is None or (guild.id, "voice") in self._disabled_events:
+            return
+        self._record(guild.id, user.id, "voice")
     
     @commands.Cog.listener()
+    @timed("listener_message")
     async def on_message(self, message):
-        if getattr(message, "guild", None):
-            if message.guild.id not in self._cache:
-                self._cache[message.guild.id] = {}
-            self._cache[message.guild.id][message.author.id] = int(time.time())
+        guild = getattr(message, "guild", None)
+        if guild is None or (guild.id, "message") in self._disabled_events:
+            return
+        self._record(guild.id, message.author.id, "message")
 
     @commands.Cog.listener()
+    @timed("listener_typing")
     async def on_typing(self, channel: discord.abc.Messageable, user: Union[discord.User, discord.Member], when: datetime.datetime):
-        if getattr(user, "guild", None):
-            if user.guild.id not in self._cache:
-                self._cache[user.guild.id] = {}
-            self._cache[user.guild.id][user.id] = int(time.time())
+        guild = getattr(user, "guild", None)
+        if guild is None or (guild.id, "typing") in self._disabled_events:
+            return
+        self._record(guild.id, user.id, "typing")
 
     @commands.Cog.listener()
+    @timed("listener_message_edit")
     async def on_message_edit(self, before: discord.Message, after: discord.Message):
-        if getattr(after, "guild", None):
-            if after.guild.id not in self._cache:
-                self._cache[after.guild.id] = {}
-            self._cache[after.guild.id][after.author.id] = int(time.time())
+        guild = getattr(after, "guild", None)
+        if guild is None or (guild.id, "edit") in self._disabled_events:
+            return
+        self._record(guild.id, after.author.id, "edit")
 
     @commands.Cog.listener()
+    @timed("listener_reaction_remove")
     async def on_reaction_remove(self, reaction: discord.Reaction, user: Union[discord.Member, discord.User]):
-        if getattr(user, "guild", None):
-            if user.guild.id not in self._cache:
-                self._cache[user.guild.id] = {}
-            self._cache[user.guild.id][user.id] = int(time.time())
+        guild = getattr(user, "guild", None)
+        if guild is None or (guild.id, "reaction") in self._disabled_events:
+            return
+        self._record(guild.id, user.id, "reaction")
 
     @commands.Cog.listener()
+    @timed("listener_reaction_add")
     async def on_reaction_add(self, reaction: discord.Reaction, user: Union[discord.Member, discord.User]):
-        if getattr(user, "guild", None):
-            if user.guild.id not in self._cache:
-                self._cache[user.guild.id] = {}
-            self._cache[user.guild.id][user.id] = int(time.time())
+        guild = getattr(user, "guild", None)
+        if guild is None or (guild.id, "reaction") in self._disabled_events:
+            return
+        self._record(guild.id, user.id, "reaction")
+
+    def _record(self, guild_id: int, member_id: int, event: str):
+        """Record activity of a member, unless it is already known within the configured resolution."""
+        self._events_seen += 1
+        if self._sampling:
+            rate = self._sampling.get((guild_id, event))
+            if rate is not None and random.random() >= rate:
+                self._events_sampled_out += 1
+                return
+        now = self._clock()
+        pending = self._cache.get(guild_id)
+        last = pending.get(member_id) if pending else None
+        if last is None:
+            index = self._index.get(guild_id)
+            if index is not None:
+                last = index.get(member_id)
+        if last is not None and now - last < self._resolution:
+            self._events_dropped += 1
+            return
+        self._update(guild_id, member_id, now)
+
+    def _clock(self) -> int:
+        """Return the current time, read at most once per event loop iteration."""
+        if self._tick is None:
+            self._tick = int(time.time())
+            self.bot.loop.call_soon(self._reset_clock)
+        return self._tick
+
+    def _reset_clock(self):
+        self._tick = None
+
+    def _update(self, guild_id: int, member_id: int, seen: int):
+        self._cache.setdefault(guild_id, {})[member_id] = seen
+        self._journal.append(guild_id, member_id, seen)
+        index = self._index.get(guild_id)
+        if index is not None:
+            if member_id not in index:
+                self._new_members.setdefault(guild_id, set()).add(member_id)
+            index.set(member_id, seen)
+
+    async def _get_index(self, guild_id: int) -> LastSeenIndex:
+        """Return the last-seen index of a guild, loading it from config on first use.
+
+        The index holds the last-seen timestamp of every known member and already includes the
+        activity that has not been flushed yet, so reads never have to touch config again.
+        """
+        index = self._index.get(guild_id)
+        if index is not None:
+            return index
+        await self._migrated.wait()
+        index = self._index.get(guild_id)
+        if index is not None:
+            return index
+        task = self._index_loading.get(guild_id)
+        if task is None:
+            task = self._index_loading[guild_id] = asyncio.ensure_future(self._load_index(guild_id))
+            task.add_done_callback(lambda _: self._index_loading.pop(guild_id, None))
+        return await asyncio.shield(task)
 
-    def cog_unload(self):
-        self.bot.loop.create_task(self._clean_up())
+    async def _load_index(self, guild_id: int) -> LastSeenIndex:
+        data = LastSeenIndex.unpack(await self.config.guild_from_id(guild_id).packed())
+        # member entries are the deltas written since the guild was last packed
+        group = self.config._get_base_group(self.config.MEMBER, str(guild_id))
+        stored = await group.all()
+        self._deltas[guild_id] = len(stored)
+        for member_id, member_data in stored.items():
+            seen = member_data.get("seen")
+            if seen and data.get(int(member_id), 0) < seen:
+                data[int(member_id)] = seen
+        # activity that is pending or currently being flushed is newer than what config returned
+        new_members = self._new_members.setdefault(guild_id, set())
+        for pending in (self._flushing, self._cache):
+            for member_id, seen in pending.get(guild_id, {}).items():
+                if member_id not in data:
+                    new_members.add(member_id)
+                if data.get(member_id, 0) < seen:
+                    data[member_id] = seen
+        index = self._index[guild_id] = LastSeenIndex(data)
+        return index
+
+    async def cog_unload(self):
+        await self._clean_up()
 
     async def _clean_up(self):
         if self._task:
             self._task.cancel()
-        if self._cache:
-            group = self.config._get_base_group(self.config.MEMBER)  # Bulk update to config
-            async with group.all() as new_data:
-                for guild_id, member_data in self._cache.items():
-                    if str(guild_id) not in new_data:
-                        new_data[str(guild_id)] = {}
+        if self._journal_task:
+            self._journal_task.cancel()
+        if self._migration_task and not self._migration_task.done():
+            # the checkpoint lets the migration continue on the next load, nothing can be flushed until then
+            self._migration_task.cancel()
+            self._journal.close()
+            return
+        try:
+            await self._flush()
+        finally:
+            # whatever could not be flushed stays in the journal for the next start
+            self._journal.close()
+
+    async def _flush(self):
+        """Write the members that changed since the last flush and return the flush metrics.
+
+        Only the dirty (guild, member) pairs are written. A flush with up to ``flush_batch_size``
+        dirty members in total gets one member-scoped write per member, a bigger one writes the
+        members of each guild in a single transaction on that guild's member entries, as every
+        write is a rewrite of the whole file on Red's JSON backend. Once a guild has collected
+        enough of these member entries they are folded into its packed blob, so the transactions
+        stay small.
+        """
+        await self._migrated.wait()
+        async with self._flush_lock:
+            if not self._cache:
+                return None
+            pending = self._flushing = self._cache
+            self._cache = {}
+            segment = self._journal.rotate()
+            start = time.perf_counter()
+            keys = 0
+            size = 0
+            try:
+                for guild_id in pending:
+                    # make sure the guild is indexed, so we know which members are new to it
+                    await self._get_index(guild_id)
+                if self._merge_safe:
+                    for guild_id, member_data in pending.items():
+                        keys -= await self._write_merged(guild_id, member_data)
+                elif sum(len(member_data) for member_data in pending.values()) > self._flush_batch_size:
+                    for guild_id, member_data in pending.items():
+                        group = self.config._get_base_group(self.config.MEMBER, str(guild_id))
+                        async with group.all() as guild_data:
+                            for member_id, seen in member_data.items():
+                                guild_data[str(member_id)] = {"seen": seen}
+                else:
+                    for guild_id, member_data in pending.items():
+                        for member_id, seen in member_data.items():
+                            await self.config.member_from_ids(guild_id, member_id).seen.set(seen)
+                new_members = {}
+                for guild_id, member_data in pending.items():
+                    added = self._new_members.get(guild_id, set()).intersection(member_data)
+                    if added:
+                        new_members[guild_id] = added
+                if self._merge_safe or sum(len(added) for added in new_members.values()) <= self._flush_batch_size:
+                    for guild_id, added in new_members.items():
+                        for member_id in added:
+                            await self.config.user_from_id(member_id).set_raw("guild_map", str(guild_id), value=True)
+                elif new_members:
+                    await self._add_to_reverse_index(new_members)
+                for guild_id, added in new_members.items():
+                    self._new_members[guild_id].difference_update(added)
+                    keys += len(added)
+                for guild_id, member_data in pending.items():
+                    keys += len(member_data)
+                    for member_id, seen in member_data.items():
+                        # size of the `"<member_id>": {"seen": <seen>}` entry as it is serialized
+                        size += len(str(member_id)) + len(str(seen)) + 14
+                    self._deltas[guild_id] = self._deltas.get(guild_id, 0) + len(member_data)
+                    if self._deltas[guild_id] > self._flush_batch_size:
+                        size += await self._compact(guild_id)
+                    # let the event loop breathe between guilds
+                    await asyncio.sleep(0)
+            except Exception:
+                # put back what we could not write, without overwriting newer activity
+                for guild_id, member_data in pending.items():
+                    cached = self._cache.setdefault(guild_id, {})
                     for member_id, seen in member_data.items():
-                        new_data[str(guild_id)][str(member_id)] = {"seen": seen}
+                        if cached.get(member_id, 0) < seen:
+                            cached[member_id] = seen
+                raise
+            finally:
+                self._flushing = {}
+            self._journal.discard_before(segment)
+            stats = dict(keys=keys, guilds=len(pending), bytes=size, seconds=time.perf_counter() - start)
+            self._last_flush = stats
+            self._last_flush_at = time.time()
+            self._metrics.observe("flush", stats["seconds"])
+            self._metrics.inc("flushed_keys", keys)
+            self._metrics.inc("flushed_bytes", size)
+            log.debug("Flushed %(keys)d keys in %(guilds)d guilds (%(bytes)d bytes) in %(seconds).3fs", stats)
+            return stats
+
+    async def _write_merged(self, guild_id: int, member_data) -> int:
+        """Write members one key at a time, skipping those that are already stored with a newer timestamp.
+
+        Returns the number of members that were skipped.
+        """
+        group = self.config._get_base_group(self.config.MEMBER, str(guild_id))
+        stored = await group.all()
+        skipped = 0
+        for member_id, seen in member_data.items():
+            if (stored.get(str(member_id)) or {}).get("seen", 0) >= seen:
+                skipped += 1
+                continue
+            await group.set_raw(str(member_id), "seen", value=seen)
+        return skipped
+
+    def _journal_path(self):
+        """The journal directory of this process, processes that share the data path each get their own by shard."""
+        path = cog_data_path(self) / "journal"
+        shard_ids = getattr(self.bot, "shard_ids", None)
+        if shard_ids:
+            path = path / "shards-{}".format("-".join(str(shard_id) for shard_id in sorted(shard_ids)))
+        return path
+
+    def _owns_guild(self, guild_id: int) -> bool:
+        """Whether the guild is on one of the shards of this process."""
+        shard_ids = getattr(self.bot, "shard_ids", None)
+        if not shard_ids:
+            return True
+        return (guild_id >> 22) % self.bot.shard_count in shard_ids
+
+    async def _compact(self, guild_id: int, force: bool = False) -> int:
+        """Fold the member entries of a guild into its packed blob once there are enough of them.
+
+        Returns the number of bytes written.
+        """
+        index = await self._get_index(guild_id)
+        threshold = min(max(self._flush_batch_size, len(index) // 4), _MAX_DELTAS)
+        if not force and self._deltas.get(guild_id, 0) <= threshold:
+            return 0
+        group = self.config._get_base_group(self.config.MEMBER, str(guild_id))
+        if self._merge_safe and not force:
+            # only the process that owns a guild rewrites its blob, and it keeps newer timestamps
+            # that were stored by any process since the index was loaded
+            if not self._owns_guild(guild_id):
+                return 0
+            stored = LastSeenIndex.unpack(await self.config.guild_from_id(guild_id).packed())
+            for member_id, member_data in (await group.all()).items():
+                seen = member_data.get("seen")
+                if seen and stored.get(int(member_id), 0) < seen:
+                    stored[int(member_id)] = seen
+            for member_id, seen in stored.items():
+                if index.get(member_id, 0) < seen:
+                    index.set(member_id, seen)
+            packed = index.pack()
+            await self.config.guild_from_id(guild_id).packed.set(packed)
+            # other processes may have written members since, only the entries that are in the blob go
+            remaining = 0
+            for member_id, member_data in (await group.all()).items():
+                if (member_data.get("seen") or 0) <= index.get(int(member_id), 0):
+                    await group.clear_raw(member_id)
+                else:
+                    remaining += 1
+            self._deltas[guild_id] = remaining
+            return len(packed)
+        packed = index.pack()
+        await self.config.guild_from_id(guild_id).packed.set(packed)
+        await group.clear()
+        self._deltas[guild_id] = 0
+        return len(packed)
+
+    async def _sync_journal(self):
+        with contextlib.suppress(asyncio.CancelledError):
+            while True:
+                await asyncio.sleep(1)
+                self._journal.sync()
 
     async def _save_to_config(self):
         await self.bot.wait_until_ready()
         with contextlib.suppress(asyncio.CancelledError):
             while True:
-                users_data = self._cache.copy()
-                self._cache = {}
-                group = self.config._get_base_group(self.config.MEMBER)  # Bulk update to config
-                async with group.all() as new_data:
-                    for guild_id, member_data in users_data.items():
-                        if str(guild_id) not in new_data:
-                            new_data[str(guild_id)] = {}
-                        for member_id, seen in member_data.items():
-                            new_data[str(guild_id)][str(member_id)] = {"seen": seen}
-
-                await asyncio.sleep(60)
\ No newline at end of file
+                try:
+                    await self._flush()
+                except Exception:
+                    self._metrics.inc("flush_errors")
+                    log.exception("Failed to flush activity to config, retrying on the next run.")
+                await asyncio.sleep(self._flush_interval)
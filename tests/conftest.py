@@ -0,0 +1,54 @@
+import asyncio
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+class FakeBot:
+    """The parts of Red the cogs use, for a bot that is always ready and never connected."""
+
+    def __init__(self, guild_ids=(), shard_ids=None, shard_count=1):
+        self.loop = asyncio.get_running_loop()
+        self.guilds = [SimpleNamespace(id=guild_id) for guild_id in guild_ids]
+        # the shards of this process when the bot is sharded across several processes
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+
+    async def wait_until_ready(self):
+        pass
+
+    async def wait_until_red_ready(self):
+        pass
+
+    def get_user(self, user_id):
+        return None
+
+
+def use_data_path(path):
+    """Point Red at JSON storage in ``path``, like its own test fixtures do."""
+    from redbot.core import data_manager
+
+    data_manager.basic_config = data_manager.basic_config_default.copy()
+    data_manager.basic_config["DATA_PATH"] = str(path)
+    data_manager.basic_config["STORAGE_TYPE"] = "JSON"
+    data_manager.basic_config["STORAGE_DETAILS"] = {}
+
+
+@pytest.fixture
+def red_data(tmp_path):
+    """Run a test against Red's JSON storage in a throwaway data path."""
+    from redbot.core import data_manager
+    from redbot.core._drivers import json as json_driver
+
+    # the JSON driver shares loaded data and locks between drivers of a cog, and its locks are
+    # bound to the event loop of the test that created them
+    json_driver._shared_datastore.clear()
+    json_driver._locks.clear()
+    saved = data_manager.basic_config
+    use_data_path(tmp_path)
+    yield tmp_path
+    data_manager.basic_config = saved
@@ -0,0 +1,261 @@
+import asyncio
+import itertools
+import random
+from types import SimpleNamespace
+
+from conftest import FakeBot
+from counting.counting import Counting
+
+GUILD = 1
+CHANNEL = 10
+
+_message_ids = itertools.count(1)
+
+
+async def _noop(*args, **kwargs):
+    pass
+
+
+def make_channel():
+    guild = SimpleNamespace(id=GUILD, get_role=lambda role_id: None)
+    return SimpleNamespace(id=CHANNEL, guild=guild, mention=f"<#{CHANNEL}>", send=_noop, set_permissions=_noop)
+
+
+def make_message(channel, user_id: int, content: str, reactions: dict):
+    message = SimpleNamespace(
+        id=next(_message_ids),
+        guild=channel.guild,
+        channel=channel,
+        author=SimpleNamespace(id=user_id, bot=False, display_name=f"user{user_id}"),
+        content=content,
+    )
+
+    async def add_reaction(emoji):
+        reactions[message.id] = emoji
+
+    message.add_reaction = add_reaction
+    return message
+
+
+async def load_counting() -> Counting:
+    counting = Counting(FakeBot([GUILD]))
+    async with counting.config.guild_from_id(GUILD).channels() as channels:
+        channels[str(CHANNEL)] = {"enabled": True}
+    await counting.cog_load()
+    # the global leaderboard of the new data
+    await counting._global_rebuild_task
+    return counting
+
+
+def test_concurrent_counts_have_exactly_one_winner_per_number(red_data):
+    users = 50
+    messages_per_user = 80
+
+    async def run():
+        counting = await load_counting()
+        rng = random.Random(0)
+        driver = counting.config._driver
+        config_get = driver.get
+
+        async def slow_get(*args, **kwargs):
+            # slow config reads, like a database backend, must not change the order messages are judged in
+            await asyncio.sleep(rng.random() / 200)
+            return await config_get(*args, **kwargs)
+
+        driver.get = slow_get
+        channel = make_channel()
+        reactions = {}
+        messages = []
+
+        async def user(user_id):
+            for _ in range(messages_per_user):
+                # everyone reads the number they see and races the others to post the next one
+                message = make_message(channel, user_id, str(counting._games[CHANNEL].current_number + 1), reactions)
+                await asyncio.sleep(rng.random() / 1000)
+                messages.append(message)
+                await counting.on_message(message)
+
+        await asyncio.gather(*(user(user_id) for user_id in range(100, 100 + users)))
+        await counting.cog_unload()
+
+        winners = {}
+        for message in messages:
+            if reactions.get(message.id) == "✅":
+                winners.setdefault(int(message.content), []).append(message.author.id)
+        game = counting._games[CHANNEL]
+        assert len(messages) == users * messages_per_user
+        # every number was posted by dozens of users at once
+        assert 0 < game.current_number < len(messages) / 10
+        # every number up to the current one was accepted once, and nothing above it
+        assert sorted(winners) == list(range(1, game.current_number + 1))
+        assert all(len(user_ids) == 1 for user_ids in winners.values())
+        # nobody counted twice in a row
+        assert all(winners[n] != winners[n + 1] for n in range(1, game.current_number))
+        # the first correct message to arrive wins, whoever's stats were cached
+        current_number, last_counter_id = 0, None
+        for message in messages:
+            if int(message.content) == current_number + 1 and message.author.id != last_counter_id:
+                current_number, last_counter_id = current_number + 1, message.author.id
+                assert reactions.get(message.id) == "✅"
+            else:
+                assert reactions.get(message.id) != "✅"
+        assert sum(entry["count"] for entry in game.leaderboard.values()) == game.current_number
+
+        stored = await counting.config.channel_from_id(CHANNEL).all()
+        assert stored["current_number"] == game.current_number
+        assert sum(entry["count"] for entry in stored["leaderboard"].values()) == game.current_number
+
+    asyncio.run(run())
+
+
+def test_big_saves_are_one_write_per_scope(red_data):
+    async def run():
+        counting = await load_counting()
+        channel = make_channel()
+        for number in range(1, 41):
+            await counting.on_message(make_message(channel, 100 + number % 20, str(number), {}))
+        writes = counting._metrics.histograms["config_set"].count
+        await counting._save_games()
+        # the channel with its leaderboard, and the stats of the guild's members
+        assert counting._metrics.histograms["config_set"].count == writes + 2
+        stored = await counting.config.channel_from_id(CHANNEL).all()
+        assert stored["current_number"] == 40
+        assert len(stored["leaderboard"]) == 20
+        assert (await counting.config.member_from_ids(GUILD, 101).all())["counts"] == 2
+        await counting.cog_unload()
+
+    asyncio.run(run())
+
+
+def test_chatter_does_not_read_config(red_data):
+    async def run():
+        counting = await load_counting()
+        channel = make_channel()
+        reads = counting._metrics.histograms["config_get"].count
+        for user_id, content in ((100, "hi"), (200, "lol"), (100, "nice")):
+            await counting.on_message(make_message(channel, user_id, content, {}))
+        assert counting._metrics.histograms["config_get"].count == reads
+        assert len(counting._stats) == 0
+        await counting.cog_unload()
+
+    asyncio.run(run())
+
+
+def test_deleted_member_stats_are_not_saved_again(red_data):
+    async def run():
+        counting = await load_counting()
+        channel = make_channel()
+        reactions = {}
+        for user_id, content in ((100, "1"), (200, "2"), (100, "3")):
+            await counting.on_message(make_message(channel, user_id, content, reactions))
+        await counting._save_games()
+        # stats in another guild, and changes that are not saved yet, loaded or not
+        counting._stats.record_count(2, 100, 5)
+        await counting._stats.get(GUILD, 100)
+        counting._stats.record_fail(GUILD, 100, 3, 4)
+
+        await counting.red_delete_data_for_user(requester="user", user_id=100)
+        await counting._save_games()
+        members = await counting.config._get_base_group(counting.config.MEMBER).all()
+        assert members == {str(GUILD): {"200": members[str(GUILD)]["200"]}}
+        assert (await counting._stats.get(GUILD, 100))["counts"] == 0
+        assert (await counting._stats.get(GUILD, 200))["counts"] == 1
+        await counting.cog_unload()
+
+    asyncio.run(run())
+
+
+class FakeContext:
+    def __init__(self, channel):
+        self.guild = channel.guild
+        self.guild.get_channel = {channel.id: channel}.get
+        self.channel = channel
+        self.sent = []
+        channel.send = self.send
+
+    async def send(self, content=None, *, embed=None):
+        self.sent.append(embed.description if embed is not None else content)
+
+
+def test_bulk_settings_are_one_write(red_data):
+    async def run():
+        counting = await load_counting()
+        ctx = FakeContext(make_channel())
+        writes = counting._metrics.histograms["config_set"].count
+        await counting.countingset.callback(counting, ctx, "fail_on_text=yes", "reset_on_fail=true", "participate_in_global_lb=1", "shamerole=none")
+        assert counting._metrics.histograms["config_set"].count == writes + 1
+        assert counting._channel_settings[CHANNEL]["fail_on_text"] is True
+        assert counting._channel_settings[CHANNEL]["reset_on_fail"] is True
+        assert counting._guild_settings[GUILD]["participate_in_global_lb"] is True
+        stored = await counting.config.guild_from_id(GUILD).all()
+        assert stored["participate_in_global_lb"] is True
+        assert stored["channels"][str(CHANNEL)]["fail_on_text"] is True
+        await counting.cog_unload()
+
+    asyncio.run(run())
+
+
+def test_bulk_settings_reject_invalid_booleans(red_data):
+    async def run():
+        counting = await load_counting()
+        ctx = FakeContext(make_channel())
+        before = await counting.config.guild_from_id(GUILD).all()
+        await counting.countingset.callback(counting, ctx, "participate_in_global_lb=yes", "fail_on_text=ture")
+        assert "`fail_on_text=ture`" in ctx.sent[-1]
+        assert await counting.config.guild_from_id(GUILD).all() == before
+        assert counting._channel_settings[CHANNEL]["fail_on_text"] is False
+        await counting.cog_unload()
+
+    asyncio.run(run())
+
+
+def test_migration_moves_rules_into_the_guild(red_data):
+    async def run():
+        from redbot.core import Config
+
+        # schema version 2 kept the rules of a counting channel in the channel scope
+        config = Config.get_conf(None, 19516548596, cog_name="Counting")
+        await config.schema_version.set(2)
+        channel_scope = config._get_base_group(config.CHANNEL)
+        await channel_scope.set_raw(str(CHANNEL), value={
+            "guild_id": GUILD, "enabled": True, "current_number": 5, "last_counter_id": 100,
+            "leaderboard": {"100": {"count": 5}}, "fail_on_text": True,
+        })
+        await channel_scope.set_raw("11", value={"guild_id": GUILD, "enabled": False, "current_number": 3})
+
+        counting = Counting(FakeBot([GUILD]))
+        await counting.cog_load()
+        await counting._global_rebuild_task
+        assert await counting.config.schema_version() == 4
+        assert list(counting._games) == [CHANNEL]
+        assert counting._games[CHANNEL].current_number == 5
+        assert counting._channel_settings[CHANNEL]["fail_on_text"] is True
+        channels = await counting.config.guild_from_id(GUILD).channels()
+        assert channels["11"]["enabled"] is False
+        assert "guild_id" not in await channel_scope.get_raw(str(CHANNEL))
+        await counting.cog_unload()
+
+    asyncio.run(run())
+
+
+def test_upgrade_builds_the_global_leaderboard(red_data):
+    async def run():
+        from redbot.core import Config
+
+        # a participating guild from before the global leaderboard was kept
+        config = Config.get_conf(None, 19516548596, cog_name="Counting")
+        await config.schema_version.set(3)
+        await config.guild_from_id(GUILD).participate_in_global_lb.set(True)
+        await config.guild_from_id(GUILD).channels.set({str(CHANNEL): {"enabled": True}, "11": {"enabled": False}})
+        await config.channel_from_id(CHANNEL).leaderboard.set({"5": {"count": 4}})
+        await config.channel_from_id(11).leaderboard.set({"5": {"count": 1}, "6": {"count": 2}})
+
+        counting = Counting(FakeBot([GUILD]))
+        await counting.cog_load()
+        await counting._global_rebuild_task
+        assert counting._global_ranking.get("5") == 5
+        assert await counting.config.global_leaderboard() == {"5": 5, "6": 2}
+        assert await counting.config.schema_version() == 4
+        await counting.cog_unload()
+
+    asyncio.run(run())
@@ -0,0 +1,29 @@
+import asyncio
+from pathlib import Path
+
+from redbot.core import Config
+
+from counting.metrics import Metrics
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def test_metrics_modules_are_in_sync():
+    seen = (ROOT / "seen" / "metrics.py").read_text(encoding="utf-8")
+    counting = (ROOT / "counting" / "metrics.py").read_text(encoding="utf-8")
+    # the files only differ in their line endings
+    assert seen.replace("\r\n", "\n") == counting.replace("\r\n", "\n")
+
+
+def test_config_calls_are_counted(red_data):
+    async def run():
+        config = Config.get_conf(None, 1, cog_name="MetricsTest")
+        config.register_global(value=0)
+        metrics = Metrics("test")
+        metrics.count_config_calls(config)
+        await config.value.set(1)
+        assert await config.value() == 1
+        assert metrics.histograms["config_set"].count == 1
+        assert metrics.histograms["config_get"].count == 1
+
+    asyncio.run(run())
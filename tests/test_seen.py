@@ -0,0 +1,200 @@
+import asyncio
+
+from redbot.core import Config
+
+from conftest import FakeBot
+from seen.index import LastSeenIndex
+from seen.seen import Seen
+
+USER = 42
+OTHER = 7
+
+
+async def load_seen(guild_ids) -> Seen:
+    seen = Seen(FakeBot(guild_ids))
+    await seen.initialize()
+    await seen._migrated.wait()
+    return seen
+
+
+async def crash(seen: Seen):
+    """Stop the cog like a killed process would, without a last flush."""
+    seen._task.cancel()
+    seen._journal_task.cancel()
+    seen._journal.sync()
+    seen._journal.close()
+    await asyncio.sleep(0)
+
+
+async def indexed_guilds(seen: Seen, user_id: int, guild_ids):
+    return {guild_id for guild_id in guild_ids if user_id in await seen._get_index(guild_id)}
+
+
+def test_big_flushes_are_one_write_per_guild(red_data):
+    async def run():
+        seen = await load_seen([1, 2])
+        for guild_id in (1, 2):
+            for member_id in range(100, 102):
+                seen._update(guild_id, member_id, 1000)
+        await seen._flush()
+        for guild_id in (1, 2):
+            for member_id in range(100, 103):
+                seen._update(guild_id, member_id, 2000)
+        writes = seen._metrics.histograms["config_set"].count
+        await seen._flush()
+        # the member entries of each guild, and the new member in the reverse index of each guild
+        assert seen._metrics.histograms["config_set"].count == writes + 4
+        assert await seen.config.user_from_id(102).guild_map() == {"1": True, "2": True}
+        for guild_id in (1, 2):
+            assert dict((await seen._load_index(guild_id)).items()) == {member_id: 2000 for member_id in range(100, 103)}
+        await seen.cog_unload()
+
+    asyncio.run(run())
+
+
+def test_many_new_members_are_one_reverse_index_write(red_data):
+    async def run():
+        seen = await load_seen([1, 2])
+        for guild_id in (1, 2):
+            for member_id in range(100, 103):
+                seen._update(guild_id, member_id, 1000)
+        writes = seen._metrics.histograms["config_set"].count
+        await seen._flush()
+        # the member entries of each guild, and the user scope
+        assert seen._metrics.histograms["config_set"].count == writes + 3
+        assert sorted(await seen.config.user_from_id(102).guilds()) == [1, 2]
+        await seen.cog_unload()
+
+    asyncio.run(run())
+
+
+def test_deleted_user_does_not_come_back_after_flush(red_data):
+    async def run():
+        seen = await load_seen([1, 2, 3])
+        for guild_id in (1, 2, 3):
+            seen._update(guild_id, USER, 1000)
+            seen._update(guild_id, OTHER, 1000)
+        await seen._flush()
+        # activity that is still pending when the deletion request comes in
+        seen._update(1, USER, 2000)
+        seen._update(2, USER, 2000)
+
+        await seen.red_delete_data_for_user(requester="discord", user_id=USER)
+        seen._update(3, OTHER, 3000)
+        await seen._flush()
+        assert await indexed_guilds(seen, USER, [1, 2, 3]) == set()
+        assert await seen.config.user_from_id(USER).guilds() == []
+        await seen.cog_unload()
+
+        seen = await load_seen([1, 2, 3])
+        assert await indexed_guilds(seen, USER, [1, 2, 3]) == set()
+        assert await indexed_guilds(seen, OTHER, [1, 2, 3]) == {1, 2, 3}
+        await seen.cog_unload()
+
+    asyncio.run(run())
+
+
+def test_deleted_user_does_not_come_back_from_the_journal(red_data):
+    async def run():
+        seen = await load_seen([1])
+        seen._update(1, USER, 1000)
+        await seen.red_delete_data_for_user(requester="discord", user_id=USER)
+        await crash(seen)
+
+        seen = await load_seen([1])
+        await seen._flush()
+        assert await indexed_guilds(seen, USER, [1]) == set()
+        await seen.cog_unload()
+
+    asyncio.run(run())
+
+
+def test_deletion_during_migration_covers_every_stored_guild(red_data):
+    async def run():
+        # schema version 3 data, guild 9 is one the bot has left
+        config = Config.get_conf(None, 2784481001, cog_name="Seen")
+        await config.schema_version.set(3)
+        for guild_id in (1, 2, 3, 9):
+            packed = LastSeenIndex({USER: 1000, OTHER: 1000}).pack()
+            await config.guild_from_id(guild_id).packed.set(packed)
+
+        seen = Seen(FakeBot([1, 2, 3]))
+        await seen.initialize()
+        # the migration to the reverse index is still running when the request comes in
+        await seen.red_delete_data_for_user(requester="discord", user_id=USER)
+        await seen._flush()
+
+        assert await indexed_guilds(seen, USER, [1, 2, 3, 9]) == set()
+        assert await seen.config.user_from_id(USER).guilds() == []
+        assert await indexed_guilds(seen, OTHER, [1, 2, 3, 9]) == {1, 2, 3, 9}
+        assert sorted(await seen.config.user_from_id(OTHER).guilds()) == [1, 2, 3, 9]
+        await seen.cog_unload()
+
+    asyncio.run(run())
+
+
+def test_migration_from_v1(red_data):
+    async def run():
+        config = Config.get_conf(None, 2784481001, cog_name="Seen")
+        # version 1 stored one timestamp per event type, guild 5 is one the bot has left
+        await config.member_from_ids(5, USER).set_raw("message", value=10)
+        await config.member_from_ids(5, USER).set_raw("typing", value=20)
+
+        seen = await load_seen([1])
+        assert await seen.config.schema_version() == 4
+        assert (await seen._get_index(5)).get(USER) == 20
+        assert await seen.config.user_from_id(USER).guilds() == [5]
+        await seen.cog_unload()
+
+    asyncio.run(run())
+
+
+def test_migration_reads_the_member_scope_after_packing_the_known_guilds(red_data):
+    async def run():
+        config = Config.get_conf(None, 2784481001, cog_name="Seen")
+        # version 1 data of a guild the bot is in and of guild 5, one it has left
+        for guild_id in (1, 5):
+            for member_id in range(100, 200):
+                await config.member_from_ids(guild_id, member_id).set_raw("message", value=member_id)
+
+        seen = Seen(FakeBot([1]))
+        driver = seen.config._driver
+        config_get = driver.get
+        member_scope_reads = []
+
+        async def get(identifier_data):
+            value = await config_get(identifier_data)
+            if identifier_data.to_tuple()[-1] == "MEMBER":
+                member_scope_reads.append(set(value))
+            return value
+
+        driver.get = get
+        await seen.initialize()
+        await seen._migrated.wait()
+        # the whole member scope was only read once guild 1 was packed
+        assert member_scope_reads == [{"5"}]
+        assert await seen.config.schema_version() == 4
+        for guild_id in (1, 5):
+            assert len(await seen._get_index(guild_id)) == 100
+        assert await seen.config.user_from_id(150).guilds() == [1, 5]
+        await seen.cog_unload()
+
+    asyncio.run(run())
+
+
+def test_unload_during_migration_stops_all_tasks(red_data):
+    async def run():
+        config = Config.get_conf(None, 2784481001, cog_name="Seen")
+        await config.guild_from_id(1).packed.set(LastSeenIndex({USER: 1000}).pack())
+        await config.schema_version.set(3)
+
+        seen = Seen(FakeBot([1]))
+        await seen.initialize()
+        await seen.cog_unload()
+        await asyncio.sleep(0)
+        # the loops swallow their cancellation, so they end as done rather than cancelled
+        assert seen._task.done()
+        assert seen._journal_task.done()
+        assert seen._migration_task.done()
+
+    asyncio.run(run())
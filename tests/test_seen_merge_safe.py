@@ -0,0 +1,185 @@
+import asyncio
+import json
+import multiprocessing
+import sqlite3
+import sys
+import traceback
+
+from redbot.core._drivers.base import BaseDriver
+
+from conftest import FakeBot, use_data_path
+from seen.index import LastSeenIndex
+from seen.seen import Seen
+
+SHARDS = 4
+# guild IDs whose shard is (guild_id >> 22) % SHARDS, ten per shard
+GUILDS = [n << 22 for n in range(1, 41)]
+MEMBERS = range(100, 110)
+# a member that only the other processes see in a guild, with activity newer than anything of its owner
+LATE_MEMBER = 999
+IDENTIFIER = "2784481001"
+
+
+class SharedDriver(BaseDriver):
+    """Config storage in one SQLite file that several processes write at once, every call is a transaction.
+
+    It stands in for a database backend, Red's JSON backend keeps a copy of the data in every process.
+    """
+
+    def __init__(self, cog_name, identifier, path):
+        super().__init__(cog_name, identifier)
+        self._path = path
+
+    @classmethod
+    async def initialize(cls, **storage_details):
+        pass
+
+    @classmethod
+    async def teardown(cls):
+        pass
+
+    @staticmethod
+    def get_config_details():
+        return {}
+
+    @classmethod
+    async def aiter_cogs(cls):
+        return
+        yield
+
+    def _transaction(self, change):
+        connection = sqlite3.connect(self._path, timeout=60, isolation_level=None)
+        try:
+            connection.execute("PRAGMA synchronous = OFF")
+            connection.execute("BEGIN IMMEDIATE")
+            data = json.loads(connection.execute("SELECT data FROM config").fetchone()[0])
+            result = change(data)
+            connection.execute("UPDATE config SET data = ?", (json.dumps(data),))
+            connection.execute("COMMIT")
+            return result
+        finally:
+            connection.close()
+
+    async def get(self, identifier_data):
+        def get(data):
+            for key in identifier_data.to_tuple():
+                data = data[key]
+            return data
+
+        return self._transaction(get)
+
+    async def set(self, identifier_data, value=None):
+        *path, last = identifier_data.to_tuple()
+
+        def set_(data):
+            for key in path:
+                data = data.setdefault(key, {})
+            data[last] = value
+
+        self._transaction(set_)
+
+    async def clear(self, identifier_data):
+        *path, last = identifier_data.to_tuple()
+
+        def clear(data):
+            for key in path:
+                data = data.get(key, {})
+            data.pop(last, None)
+
+        self._transaction(clear)
+
+
+async def load_seen(shard: int, db_path: str) -> Seen:
+    seen = Seen(FakeBot(GUILDS, shard_ids=[shard], shard_count=SHARDS))
+    seen.config._driver = SharedDriver("Seen", IDENTIFIER, db_path)
+    await seen.initialize()
+    await seen._migrated.wait()
+    return seen
+
+
+def owned_guilds(shard: int):
+    return [guild_id for guild_id in GUILDS if (guild_id >> 22) % SHARDS == shard]
+
+
+async def run_shard(shard: int, db_path: str, barrier):
+    wait = lambda: barrier.wait(60)  # noqa: E731
+    owned = owned_guilds(shard)
+    # activity of another process' guilds, that this process saw late, e.g. replayed after a restart
+    foreign = owned_guilds((shard + 1) % SHARDS)
+
+    seen = await load_seen(shard, db_path)
+    written = {}
+    for guild_id, seen_at in [(guild_id, 2000) for guild_id in owned] + [(guild_id, 100) for guild_id in foreign]:
+        for member_id in MEMBERS:
+            seen._update(guild_id, member_id, seen_at)
+            written.setdefault(guild_id, {})[member_id] = seen_at
+    # every process is killed before it flushes
+    seen._task.cancel()
+    seen._journal_task.cancel()
+    seen._journal.sync()
+    seen._journal.close()
+    wait()
+
+    # each process replays its own journal and nothing of the others
+    seen = await load_seen(shard, db_path)
+    assert seen._cache == written
+    wait()
+    await seen._flush()
+    wait()
+
+    # entries the owners have not loaded, which their next compaction has to keep
+    for guild_id in foreign:
+        seen._update(guild_id, LATE_MEMBER, 5000)
+    await seen._flush()
+    wait()
+
+    # owners see new activity while the others flush more stale activity at the same time
+    for member_id in MEMBERS:
+        for guild_id in owned:
+            seen._update(guild_id, member_id, 3000)
+        for guild_id in foreign:
+            seen._update(guild_id, member_id, 150)
+    await seen._flush()
+    await seen.cog_unload()
+
+
+def shard_process(shard: int, data_path: str, db_path: str, barrier):
+    use_data_path(data_path)
+    try:
+        asyncio.run(run_shard(shard, db_path, barrier))
+    except BaseException:
+        traceback.print_exc()
+        barrier.abort()
+        sys.exit(1)
+
+
+def test_processes_in_merge_safe_mode_keep_the_newest_activity(tmp_path):
+    db_path = str(tmp_path / "config.db")
+    with sqlite3.connect(db_path) as connection:
+        connection.execute("CREATE TABLE config (data TEXT)")
+        # the data is already migrated, and small batches make the owners compact their guilds
+        settings = dict(schema_version=4, merge_safe=True, flush_batch_size=5)
+        connection.execute("INSERT INTO config VALUES (?)", (json.dumps({"Seen": {IDENTIFIER: {"GLOBAL": settings}}}),))
+
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(SHARDS)
+    processes = [
+        context.Process(target=shard_process, args=(shard, str(tmp_path), db_path, barrier)) for shard in range(SHARDS)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(120)
+    assert [process.exitcode for process in processes] == [0] * SHARDS
+
+    with sqlite3.connect(db_path) as connection:
+        data = json.loads(connection.execute("SELECT data FROM config").fetchone()[0])["Seen"][IDENTIFIER]
+    for guild_id in GUILDS:
+        stored = LastSeenIndex.unpack(data["GUILD"].get(str(guild_id), {}).get("packed"))
+        for member_id, entry in data.get("MEMBER", {}).get(str(guild_id), {}).items():
+            if stored.get(int(member_id), 0) < entry["seen"]:
+                stored[int(member_id)] = entry["seen"]
+        assert stored == {**{member_id: 3000 for member_id in MEMBERS}, LATE_MEMBER: 5000}
+    for member_id in [*MEMBERS, LATE_MEMBER]:
+        assert data["USER"][str(member_id)]["guild_map"] == {str(guild_id): True for guild_id in GUILDS}
+    assert sorted(path.name for path in tmp_path.rglob("shards-*")) == [f"shards-{shard}" for shard in range(SHARDS)]